@@ -0,0 +1,113 @@
+"""Time "clear all history" on a large SQLite history while reserves keep coming.
+
+    python bench/bench_clear.py --rows 500000,2000000
+
+For every size the history is preloaded, then clear_all_history runs while a
+background loop keeps calling reserve_user. The report lists how long the
+clear took and the slowest reserve, which waits for the writer lock the clear
+holds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_matching import percentile, preload_history  # noqa: E402
+
+
+def int_list(value):
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int_list, default=[500000], help="comma-separated history sizes")
+    parser.add_argument("--db", default=None, help="SQLite path (default: temporary file)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    # settings are read at import time, so this runs before mquick is imported
+    if args.db is None:
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mquick-clear-"), "clear.db")
+    else:
+        os.environ["SQLITE_PATH"] = args.db
+
+
+async def reserve_loop(db, waits, stopping):
+    i = 0
+    while not stopping.is_set():
+        start = time.perf_counter()
+        await db.reserve_user(f"live{i}", 2)
+        waits.append(time.perf_counter() - start)
+        i += 1
+        await asyncio.sleep(0.005)
+
+
+async def run_step(db, rows):
+    await preload_history(db, rows)
+    await db.history_cache.load()
+    waits = []
+    stopping = asyncio.Event()
+    reserves = asyncio.create_task(reserve_loop(db, waits, stopping))
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    await db.clear_all_history()
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.2)
+    stopping.set()
+    await reserves
+    return {
+        "rows": rows,
+        "clear_s": round(elapsed, 3),
+        "total_after": await db.history_total_count(),
+        "reserves": len(waits),
+        "reserve_p50_ms": round(percentile(waits, 50) * 1000, 2),
+        "reserve_max_ms": round(max(waits, default=0) * 1000, 2),
+    }
+
+
+async def run(args):
+    from mquick import db
+
+    await db.init_db()
+    db.history_writer.start()
+    steps = []
+    try:
+        for rows in args.rows:
+            steps.append(await run_step(db, rows))
+    finally:
+        await db.history_writer.close()
+        await db.close_db()
+    return steps
+
+
+def print_report(steps):
+    for step in steps:
+        print(
+            f"{step['rows']:>9} rows: clear {step['clear_s']}s, {step['total_after']} left, "
+            f"{step['reserves']} reserves, p50 {step['reserve_p50_ms']}ms, max {step['reserve_max_ms']}ms"
+        )
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    steps = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(steps, indent=2))
+    else:
+        print_report(steps)
+
+
+if __name__ == "__main__":
+    main_cli()
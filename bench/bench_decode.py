@@ -0,0 +1,58 @@
+"""Compare explore-page decoding backends.
+
+    python bench/bench_decode.py --users 50 --rounds 2000
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from mquick import matching  # noqa: E402
+from fake_meeff import FakeMeeff  # noqa: E402
+
+
+def legacy_decode(body):
+    text = body.decode()
+    data = json.loads(text)
+    return [(u.get("_id"), u.get("nationalityCode") or u.get("locale")) for u in data.get("users", [])]
+
+
+def typed_decode(body):
+    return [(u.user_id, u.nationality_code or u.locale) for u in matching.decode_explore(body)]
+
+
+def measure(fn, body, rounds):
+    seconds = timeit.timeit(lambda: fn(body), number=rounds)
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds / rounds * 1e6, peak / 1024
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args(argv)
+    fake = FakeMeeff(page_size=args.users, seen_ratio=0.0, seed=1)
+    page = {"users": [fake._user() for _ in range(args.users)]}
+    for user in page["users"]:
+        user.update({"description": "x" * 200, "languageCodes": ["en", "ko"], "photoUrls": ["https://example.invalid/a.jpg"] * 6})
+    body = json.dumps(page).encode()
+    if matching._explore_decoder is not None and matching.JSON_BACKEND in ("auto", "msgspec"):
+        backend = "msgspec typed"
+    else:
+        backend = getattr(matching.json_loads, "__module__", None) or "json"
+    print(f"page: {args.users} users, {len(body)} bytes; decode_explore backend: {backend}")
+    for name, fn in (("legacy text+json", legacy_decode), ("decode_explore", typed_decode)):
+        per_call, peak = measure(fn, body, args.rounds)
+        print(f"{name:<18} {per_call:8.1f} us/page  peak {peak:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main_cli()
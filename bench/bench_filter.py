@@ -0,0 +1,75 @@
+"""Compare the per-user country filter loop with the compiled CountryFilter.
+
+    python bench/bench_filter.py --users 50 --rounds 5000
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from mquick import db, matching  # noqa: E402
+from fake_meeff import COUNTRIES  # noqa: E402
+
+
+def legacy_select(users, countries_enabled, countries_mode, countries):
+    countries_list = set([c.upper() for c in countries])
+    selected = []
+    for user in users:
+        user_id = user.user_id
+        if not user_id:
+            continue
+        nat = user.nationality_code or user.locale
+        if nat:
+            nat_code = nat.upper()
+            if "-" in nat_code:
+                nat_code = nat_code.split("-")[-1]
+        else:
+            nat_code = None
+        if countries_mode == "exclude":
+            if countries_enabled and nat_code and nat_code in countries_list:
+                continue
+        else:
+            if countries_enabled:
+                if not nat_code or nat_code not in countries_list:
+                    continue
+        selected.append(user_id)
+    return selected
+
+
+def make_page(n, rng):
+    users = []
+    for i in range(n):
+        code = rng.choice(COUNTRIES)
+        if rng.random() < 0.7:
+            users.append(matching.ExploreUser(f"u{i}", code.lower() if rng.random() < 0.3 else code, None))
+        else:
+            users.append(matching.ExploreUser(f"u{i}", None, f"en-{code}" if rng.random() < 0.9 else None))
+    return users
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5000)
+    args = parser.parse_args(argv)
+    rng = random.Random(1)
+    page = make_page(args.users, rng)
+    for mode in ("exclude", "include"):
+        countries = ["kr", "JP", "us"]
+        settings = db.ChatSettings(True, mode, frozenset(c.upper() for c in countries), True)
+        assert legacy_select(page, True, mode, countries) == settings.country_filter.select(page)
+        legacy = timeit.timeit(lambda: legacy_select(page, True, mode, countries), number=args.rounds)
+        compiled = timeit.timeit(lambda: settings.country_filter.select(page), number=args.rounds)
+        per_legacy = legacy / args.rounds * 1e6
+        per_compiled = compiled / args.rounds * 1e6
+        print(
+            f"{mode:<8} legacy {per_legacy:7.2f} us/page  compiled {per_compiled:7.2f} us/page  "
+            f"speedup {per_legacy / per_compiled:4.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,218 @@
+"""Benchmark start_matching against a local fake Meeff API and a stubbed bot.
+
+    python bench/bench_matching.py --tasks 20 --duration 30 --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_meeff import FakeMeeff  # noqa: E402
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeStatMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat = FakeChat(chat_id)
+        self.message_id = message_id
+        self.edits = 0
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=10, help="concurrent tokens")
+    parser.add_argument("--chats", type=int, default=0, help="distinct chats (default: one per task)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--seen-ratio", type=float, default=0.5)
+    parser.add_argument("--empty-ratio", type=float, default=0.0)
+    parser.add_argument("--history-size", type=int, default=0, help="rows preloaded into history")
+    parser.add_argument("--db", default=None, help="SQLite path (default: temporary file)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--idle-backoff", choices=("fixed", "exponential", "jittered"), help="IDLE_BACKOFF policy")
+    parser.add_argument("--loop", choices=("asyncio", "uvloop", "auto"), default="asyncio", help="event loop backend")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="loop lag sampling interval in seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+async def preload_history(db, count, start=0):
+    now = "2024-01-01T00:00:00"
+    chunk = []
+    for i in range(start, start + count):
+        user_id = f"pre{i:021d}"
+        chunk.append((user_id, 1, now))
+        if len(chunk) >= 10000 or i == start + count - 1:
+            await db.sql_db.executemany(
+                "INSERT OR IGNORE INTO history(user_id, first_added_at, reserved) VALUES(?, ?, 0)",
+                [(user_id, added_at) for user_id, _, added_at in chunk],
+            )
+            await db.sql_db.executemany(
+                "INSERT OR IGNORE INTO history_chat(user_id, chat_id, added_at) VALUES(?, ?, ?)",
+                chunk,
+            )
+            await db.sql_db.commit()
+            chunk = []
+
+
+def db_op_counts(metrics):
+    counts = {}
+    for (name, labels), (_, _, count) in metrics.histograms.items():
+        if name == "mquick_db_query_seconds":
+            counts[dict(labels)["helper"]] = count
+    return counts
+
+
+def configure(args):
+    # settings are read at import time, so this runs before mquick is imported
+    if args.db is None:
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mquick-bench-"), "bench.db")
+    else:
+        os.environ["SQLITE_PATH"] = args.db
+    if args.idle_backoff:
+        os.environ["IDLE_BACKOFF"] = args.idle_backoff
+
+
+async def run(args):
+    from mquick import db, matching
+    from mquick.metrics import metrics
+    from mquick.runtime import LoopLagMonitor
+
+    fake = await FakeMeeff(
+        latency_ms=args.latency_ms,
+        page_size=args.page_size,
+        error_ratio=args.error_ratio,
+        rate_limit_ratio=args.rate_limit_ratio,
+        seen_ratio=args.seen_ratio,
+        empty_ratio=args.empty_ratio,
+        seed=args.seed,
+    ).start()
+    matching.ANSWER_URL = fake.answer_url
+
+    cycle_times = []
+    last_fetch = {}
+    fetch_users = matching.fetch_users
+
+    async def timed_fetch_users(session, explore_url, headers=None):
+        now = time.perf_counter()
+        key = (headers or {}).get("meeff-access-token")
+        if key in last_fetch:
+            cycle_times.append(now - last_fetch[key])
+        last_fetch[key] = now
+        return await fetch_users(session, explore_url, headers)
+
+    matching.fetch_users = timed_fetch_users
+
+    await db.init_db()
+    if args.history_size:
+        await preload_history(db, args.history_size)
+    await db.history_cache.load()
+    db.history_writer.start()
+
+    # the stop keyboard pulls in aiogram lazily; load it before measuring
+    matching.stop_keyboard("warmup")
+    lag_monitor = LoopLagMonitor(interval=args.lag_interval)
+    lag_task = asyncio.create_task(lag_monitor.run())
+    tracemalloc.start()
+    chats = args.chats or args.tasks
+    tasks = []
+    started = time.perf_counter()
+    for i in range(args.tasks):
+        chat_id = 1000 + i % chats
+        token = f"bench-{i}"
+        stats = matching.TaskStats()
+        msg = FakeStatMessage(chat_id, i + 1)
+        task_id = uuid.uuid4().hex
+        matching.launch_matching_task(chat_id, token, fake.explore_url, msg, task_id, stats)
+        tasks.append((token, stats, msg, matching.matching_tasks[f"{chat_id}:{token}"]))
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+    stopped_early = sum(1 for _, _, _, task in tasks if task.done())
+    await matching.stop_all_tasks()
+    await db.history_writer.close()
+    await matching.http_sessions.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests = sum(stats.requests for _, stats, _, _ in tasks)
+    cycles = sum(stats.cycles for _, stats, _, _ in tasks)
+    ops = db_op_counts(metrics)
+    report = {
+        "tasks": args.tasks,
+        "chats": chats,
+        "duration_s": round(elapsed, 2),
+        "requests": requests,
+        "cycles": cycles,
+        "errors": sum(stats.errors for _, stats, _, _ in tasks),
+        "stopped_early": stopped_early,
+        "requests_per_task_per_s": round(requests / args.tasks / elapsed, 3),
+        "cycles_per_task_per_s": round(cycles / args.tasks / elapsed, 3),
+        "db_ops": sum(ops.values()),
+        "db_ops_per_user": round(sum(ops.values()) / requests, 3) if requests else None,
+        "db_ops_by_helper": ops,
+        "writer_commits": db.history_writer.flushes,
+        "cache_hits": db.history_cache.hits,
+        "cycle_p50_ms": round(percentile(cycle_times, 50) * 1000, 1),
+        "cycle_p99_ms": round(percentile(cycle_times, 99) * 1000, 1),
+        "empty_polls": sum(stats.empty_polls for _, stats, _, _ in tasks),
+        "idle_share": round(sum(stats.idle for _, stats, _, _ in tasks) / args.tasks / elapsed, 3),
+        "stat_edits": sum(msg.edits for _, _, msg, _ in tasks),
+        "explore_calls": fake.explore_calls,
+        "answer_calls": fake.answer_calls,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+    report.update(lag_monitor.summary())
+    await fake.stop()
+    await db.close_db()
+    return report
+
+
+def print_report(report):
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key.ljust(width)}  {value}")
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    from mquick.runtime import run as run_loop
+
+    report = run_loop(run(args), backend=args.loop)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main_cli()
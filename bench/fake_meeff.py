@@ -0,0 +1,96 @@
+"""Local stand-in for the Meeff explore and answer endpoints."""
+import asyncio
+import random
+import uuid
+
+from aiohttp import web
+
+COUNTRIES = ("KR", "JP", "US", "VN", "ID", "PH", "TH", "BR", "DE", "FR")
+
+
+class FakeMeeff:
+    def __init__(
+        self,
+        latency_ms=20.0,
+        page_size=20,
+        error_ratio=0.0,
+        rate_limit_ratio=0.0,
+        seen_ratio=0.5,
+        empty_ratio=0.0,
+        seed=None,
+    ):
+        self.latency = latency_ms / 1000
+        self.page_size = page_size
+        self.error_ratio = error_ratio
+        self.rate_limit_ratio = rate_limit_ratio
+        self.seen_ratio = seen_ratio
+        self.empty_ratio = empty_ratio
+        self.random = random.Random(seed)
+        self.served = []
+        self.explore_calls = 0
+        self.answer_calls = 0
+        self.answer_status = {}
+        self.runner = None
+        self.port = None
+
+    def _user(self):
+        if self.served and self.random.random() < self.seen_ratio:
+            user_id = self.random.choice(self.served)
+        else:
+            user_id = uuid.uuid4().hex[:24]
+            self.served.append(user_id)
+        user = {"_id": user_id, "name": "bench", "birthYear": 1999, "photoUrls": ["https://example.invalid/p.jpg"]}
+        if self.random.random() < 0.8:
+            user["nationalityCode"] = self.random.choice(COUNTRIES)
+        else:
+            user["locale"] = f"en-{self.random.choice(COUNTRIES)}"
+        return user
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+    async def explore(self, request):
+        self.explore_calls += 1
+        await self._delay()
+        if self.random.random() < self.error_ratio:
+            return web.Response(status=500, text="error")
+        if self.random.random() < self.empty_ratio:
+            return web.json_response({"users": []})
+        return web.json_response({"users": [self._user() for _ in range(self.page_size)]})
+
+    async def answer(self, request):
+        self.answer_calls += 1
+        await self._delay()
+        roll = self.random.random()
+        if roll < self.rate_limit_ratio:
+            status, body = 429, {"errorCode": "LikeExceeded"}
+        elif roll < self.rate_limit_ratio + self.error_ratio:
+            status, body = 500, {"errorCode": "Internal"}
+        else:
+            status, body = 200, {"ok": True}
+        self.answer_status[status] = self.answer_status.get(status, 0) + 1
+        return web.json_response(body, status=status)
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/user/explore/v2", self.explore)
+        app.router.add_get("/user/undoableAnswer/v5/", self.answer)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def explore_url(self):
+        return f"http://127.0.0.1:{self.port}/user/explore/v2?lat=0&lng=0"
+
+    @property
+    def answer_url(self):
+        return f"http://127.0.0.1:{self.port}/user/undoableAnswer/v5/?userId={{user_id}}&isOkay=1"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
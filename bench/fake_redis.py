@@ -0,0 +1,152 @@
+"""Local stand-in for a Redis server, covering the commands RedisStorage uses."""
+import asyncio
+
+OK = object()
+PONG = object()
+QUEUED = object()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.server = None
+        self.port = None
+        self.commands = 0
+
+    def _set(self, key):
+        return self.data.setdefault(key, set())
+
+    def _hash(self, key):
+        return self.data.setdefault(key, {})
+
+    def _drop_empty(self, key):
+        if key in self.data and not self.data[key]:
+            del self.data[key]
+
+    def handle(self, name, args):
+        if name == "PING":
+            return PONG
+        if name in ("AUTH", "SELECT", "FLUSHDB"):
+            if name == "FLUSHDB":
+                self.data.clear()
+            return OK
+        if name == "SADD":
+            s = self._set(args[0])
+            before = len(s)
+            s.update(args[1:])
+            return len(s) - before
+        if name == "SREM":
+            s = self.data.get(args[0], set())
+            removed = len(s & set(args[1:]))
+            s.difference_update(args[1:])
+            self._drop_empty(args[0])
+            return removed
+        if name == "SCARD":
+            return len(self.data.get(args[0], ()))
+        if name == "SMEMBERS":
+            return sorted(self.data.get(args[0], ()))
+        if name == "SINTER":
+            sets = [self.data.get(key, set()) for key in args]
+            return sorted(set.intersection(*sets))
+        if name == "SSCAN":
+            members = sorted(self.data.get(args[0], ()))
+            cursor = int(args[1])
+            count = int(args[args.index("COUNT") + 1]) if "COUNT" in args else 10
+            page = members[cursor:cursor + count]
+            nxt = cursor + count if cursor + count < len(members) else 0
+            return [str(nxt), page]
+        if name == "HSET":
+            h = self._hash(args[0])
+            added = 0
+            for field, value in zip(args[1::2], args[2::2]):
+                added += field not in h
+                h[field] = value
+            return added
+        if name == "HSETNX":
+            h = self._hash(args[0])
+            if args[1] in h:
+                return 0
+            h[args[1]] = args[2]
+            return 1
+        if name == "GET":
+            return self.data.get(args[0])
+        if name == "INCR":
+            value = int(self.data.get(args[0], 0)) + 1
+            self.data[args[0]] = str(value)
+            return value
+        if name == "HGET":
+            return self.data.get(args[0], {}).get(args[1])
+        if name == "HDEL":
+            h = self.data.get(args[0], {})
+            removed = sum(1 for field in args[1:] if h.pop(field, None) is not None)
+            self._drop_empty(args[0])
+            return removed
+        if name == "HGETALL":
+            return [x for item in self.data.get(args[0], {}).items() for x in item]
+        if name == "DEL":
+            return sum(1 for key in args if self.data.pop(key, None) is not None)
+        return ValueError(f"ERR unknown command '{name}'")
+
+    def _encode(self, value):
+        if isinstance(value, ValueError):
+            return b"-%s\r\n" % str(value).encode()
+        if value is OK or value is PONG or value is QUEUED:
+            return {OK: b"+OK\r\n", PONG: b"+PONG\r\n", QUEUED: b"+QUEUED\r\n"}[value]
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self._encode(v) for v in value)
+        data = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _transact(self, queued, name, args):
+        # MULTI queues commands per connection; EXEC runs them in one go, and
+        # nothing else can run in between on this single-threaded server
+        if name == "MULTI":
+            return [], OK
+        if name == "EXEC":
+            return None, [self.handle(*command) for command in queued]
+        if name == "DISCARD":
+            return None, OK
+        queued.append((name, args))
+        return queued, QUEUED
+
+    async def _serve(self, reader, writer):
+        queued = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2].decode())
+                self.commands += 1
+                name = args[0].upper()
+                if queued is not None or name == "MULTI":
+                    queued, reply = self._transact(queued, name, args[1:])
+                else:
+                    reply = self.handle(name, args[1:])
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,314 @@
+"""Load-test the aiogram handlers with synthetic updates while matching tasks run.
+
+    python bench/load_handlers.py --chats 1,10,50 --history 0,100000 --updates 600 --rate 100
+
+Updates go straight into dp.feed_update with a stubbed Bot; matching tasks
+started by the token messages run against a local fake Meeff API. For every
+history size and chat count the report lists per-handler latency percentiles,
+how long SQLite statements queued for the writer and reader connections, and
+event-loop lag.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_matching import percentile, preload_history  # noqa: E402
+from fake_meeff import FakeMeeff  # noqa: E402
+
+HANDLERS = ("countries_cmd", "history_cmd", "_hist_toggle", "_countries_mode_toggle", "receive_token", "_stop_task")
+
+
+def int_list(value):
+    return [int(x) for x in value.split(",") if x.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int_list, default=[1, 10, 50], help="comma-separated chat counts")
+    parser.add_argument("--history", type=int_list, default=[0, 100000], help="comma-separated history sizes")
+    parser.add_argument("--updates", type=int, default=600, help="updates per step")
+    parser.add_argument("--rate", type=float, default=100.0, help="updates per second (open loop)")
+    parser.add_argument("--tasks-per-chat", type=int, default=1, help="background matching tasks per chat")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake Meeff API latency")
+    parser.add_argument("--bot-latency-ms", type=float, default=30.0, help="stubbed Telegram API latency")
+    parser.add_argument("--db", default=None, help="SQLite path (default: temporary file)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    # settings are read at import time, so this runs before mquick is imported
+    if args.db is None:
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mquick-load-"), "load.db")
+    else:
+        os.environ["SQLITE_PATH"] = args.db
+
+
+def make_stub_bot(latency):
+    from aiogram import Bot
+
+    class StubBot(Bot):
+        # answers every API call locally after a fixed delay
+        async def __call__(self, method, request_timeout=None):
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if latency:
+                await asyncio.sleep(latency)
+            if name == "SendMessage":
+                return SimpleNamespace(message_id=self.calls[name])
+            return True
+
+    bot = StubBot("123456:LOADTEST")
+    bot.calls = {}
+    return bot
+
+
+class ConnectionWaits:
+    # time from handing a statement to an aiosqlite connection until its
+    # thread starts running it: the wait for the shared SQLite connection
+    def __init__(self):
+        self.waits = {}
+
+    def watch(self, conn, name):
+        original = conn._execute
+        waits = self.waits.setdefault(name, [])
+
+        async def _execute(fn, *args, **kwargs):
+            queued = time.perf_counter()
+
+            def timed():
+                waits.append(time.perf_counter() - queued)
+                return fn(*args, **kwargs)
+
+            return await original(timed)
+
+        conn._execute = _execute
+
+    def reset(self):
+        for waits in self.waits.values():
+            waits.clear()
+
+    def summary(self):
+        report = {}
+        for name, waits in self.waits.items():
+            report[name] = {
+                "statements": len(waits),
+                "p50_ms": round(percentile(waits, 50) * 1000, 2),
+                "p99_ms": round(percentile(waits, 99) * 1000, 2),
+                "max_ms": round(max(waits, default=0) * 1000, 2),
+            }
+        return report
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+        self.now = int(time.time())
+
+    def _validate(self, payload):
+        from aiogram.types import Update
+        self.update_id += 1
+        payload["update_id"] = self.update_id
+        return Update.model_validate(payload, context={"bot": self.bot})
+
+    def _chat(self, chat_id):
+        return {"id": chat_id, "type": "private"}, {"id": chat_id, "is_bot": False, "first_name": "load"}
+
+    def message(self, chat_id, text):
+        chat, user = self._chat(chat_id)
+        return self._validate({
+            "message": {"message_id": self.update_id + 1, "date": self.now, "chat": chat, "from": user, "text": text},
+        })
+
+    def callback(self, chat_id, data):
+        chat, user = self._chat(chat_id)
+        return self._validate({
+            "callback_query": {
+                "id": str(self.update_id + 1), "from": user, "chat_instance": str(chat_id), "data": data,
+                "message": {"message_id": 1, "date": self.now, "chat": chat, "text": "stats"},
+            },
+        })
+
+
+def pick_update(factory, handler, chat_id, step, i, started):
+    from mquick.matching import task_meta
+    if handler == "countries_cmd":
+        return factory.message(chat_id, "/countries")
+    if handler == "history_cmd":
+        return factory.message(chat_id, "/history")
+    if handler == "_hist_toggle":
+        return factory.callback(chat_id, f"hist_toggle:{chat_id}")
+    if handler == "_countries_mode_toggle":
+        return factory.callback(chat_id, f"countries_mode_toggle:{chat_id}")
+    if handler == "receive_token":
+        return factory.message(chat_id, f"load-{step}-{i}")
+    # stop the newest task a token message started in this chat, if any
+    task_id = "missing"
+    for key in reversed(started.get(chat_id, [])):
+        candidates = [tid for tid, meta in task_meta.items() if meta["key"] == key]
+        if candidates:
+            task_id = candidates[0]
+            break
+    return factory.callback(chat_id, f"stop_task:{task_id}")
+
+
+async def stop_tasks():
+    from mquick.matching import matching_tasks, task_meta
+    tasks = []
+    for meta in list(task_meta.values()):
+        meta["running"] = False
+        task = matching_tasks.pop(meta["key"], None)
+        if task is not None:
+            task.cancel()
+            tasks.append(task)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_step(args, bot, dp, factory, waits, history_size, chats, step):
+    from mquick.runtime import LoopLagMonitor
+
+    chat_ids = [5000 + i for i in range(chats)]
+    for chat_id in chat_ids:
+        for n in range(args.tasks_per_chat):
+            await dp.feed_update(bot, factory.message(chat_id, f"bg-{step}-{chat_id}-{n}"))
+    await asyncio.sleep(1)
+
+    waits.reset()
+    bot.calls.clear()
+    lag_monitor = LoopLagMonitor(interval=0.05)
+    lag_task = asyncio.create_task(lag_monitor.run())
+    latencies = {name: [] for name in HANDLERS}
+    errors = {name: 0 for name in HANDLERS}
+    started = {}
+
+    async def feed(handler, update):
+        start = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            errors[handler] += 1
+        latencies[handler].append(time.perf_counter() - start)
+
+    pending = []
+    began = time.perf_counter()
+    for i in range(args.updates):
+        if args.rate > 0:
+            delay = began + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        handler = HANDLERS[i % len(HANDLERS)]
+        chat_id = chat_ids[(i // len(HANDLERS)) % chats]
+        if handler == "receive_token":
+            started.setdefault(chat_id, []).append(f"{chat_id}:load-{step}-{i}")
+        pending.append(asyncio.create_task(feed(handler, pick_update(factory, handler, chat_id, step, i, started))))
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - began
+    lag_task.cancel()
+    await stop_tasks()
+
+    return {
+        "history": history_size,
+        "chats": chats,
+        "updates": args.updates,
+        "elapsed_s": round(elapsed, 2),
+        "handlers": {
+            name: {
+                "n": len(values),
+                "errors": errors[name],
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(max(values, default=0) * 1000, 1),
+            }
+            for name, values in latencies.items()
+        },
+        "sqlite_waits": waits.summary(),
+        "loop": lag_monitor.summary(),
+        "bot_calls": dict(bot.calls),
+    }
+
+
+async def run(args):
+    from mquick import app, db, matching
+
+    fake = await FakeMeeff(latency_ms=args.latency_ms).start()
+    matching.ANSWER_URL = fake.answer_url
+    bot = make_stub_bot(args.bot_latency_ms / 1000)
+    dp = app.create_dispatcher()
+    matching.bot = bot
+    factory = UpdateFactory(bot)
+
+    await db.init_db()
+    waits = ConnectionWaits()
+    waits.watch(db.sql_db, "writer")
+    for conn in db.read_pool.conns:
+        waits.watch(conn, "readers")
+    await db.set_config_value("explore_url", fake.explore_url)
+    db.history_writer.start()
+
+    steps = []
+    loaded = 0
+    try:
+        for history_size in sorted(args.history):
+            if history_size > loaded:
+                await preload_history(db, history_size - loaded, start=loaded)
+                loaded = history_size
+            await db.history_writer.flush()
+            await db.history_cache.load()
+            for chats in args.chats:
+                steps.append(await run_step(args, bot, dp, factory, waits, history_size, chats, len(steps)))
+    finally:
+        await stop_tasks()
+        await matching.http_sessions.close()
+        await db.history_writer.close()
+        await db.close_db()
+        await fake.stop()
+    return steps
+
+
+def print_report(steps):
+    for step in steps:
+        print(
+            f"history {step['history']}  chats {step['chats']}  "
+            f"{step['updates']} updates in {step['elapsed_s']}s"
+        )
+        print(f"  {'handler':<24}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+        for name, h in step["handlers"].items():
+            print(
+                f"  {name:<24}{h['n']:>6}{h['errors']:>5}{h['p50_ms']:>9}{h['p95_ms']:>9}{h['p99_ms']:>9}{h['max_ms']:>9}"
+            )
+        for name, w in step["sqlite_waits"].items():
+            print(
+                f"  sqlite {name} wait: {w['statements']} statements, p50 {w['p50_ms']}ms, "
+                f"p99 {w['p99_ms']}ms, max {w['max_ms']}ms"
+            )
+        loop = step["loop"]
+        print(f"  loop lag: p99 {loop['lag_p99_ms']}ms, max {loop['lag_max_ms']}ms, {loop['stalls']} stalls")
+        print()
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    from mquick.runtime import run as run_loop
+
+    steps = run_loop(run(args))
+    if args.json:
+        print(json.dumps(steps, indent=2))
+    else:
+        print_report(steps)
+
+
+if __name__ == "__main__":
+    main_cli()
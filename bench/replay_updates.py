@@ -0,0 +1,89 @@
+"""Post recorded or synthetic Telegram updates to a local webhook.
+
+    BOT_MODE=webhook WEBHOOK_SECRET=s python main.py
+    python bench/replay_updates.py --url http://127.0.0.1:8080/webhook --secret s --file updates.jsonl
+
+Without --file, --count synthetic /history and /countries messages are posted.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+def synthetic_updates(count, chats, start_id=1):
+    commands = ("/history", "/countries", "/start")
+    now = int(time.time())
+    for i in range(count):
+        chat_id = 100000 + i % chats
+        yield {
+            "update_id": start_id + i,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+                "text": commands[i % len(commands)],
+            },
+        }
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def replay(url, secret, updates, concurrency):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies = []
+    statuses = {}
+    sem = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update):
+            async with sem:
+                start = time.perf_counter()
+                async with session.post(url, json=update) as res:
+                    await res.read()
+                    latencies.append(time.perf_counter() - start)
+                    statuses[res.status] = statuses.get(res.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--file", default=None, help="JSONL file of recorded Update payloads")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args(argv)
+    updates = list(load_updates(args.file)) if args.file else list(synthetic_updates(args.count, args.chats))
+    latencies, statuses, elapsed = asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+    print(f"posted {len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s)")
+    print(f"statuses {statuses}")
+    print(
+        f"accept latency p50 {percentile(latencies, 50) * 1000:.1f}ms "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}ms max {max(latencies, default=0) * 1000:.1f}ms"
+    )
+    print("handling latency by mode: see mquick_update_seconds on the /metrics endpoint")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,250 @@
+"""Run the same storage checks against every history/dedupe backend.
+
+    python bench/storage_conformance.py                 # sqlite + local fake redis
+    python bench/storage_conformance.py --redis-url redis://127.0.0.1:6379/15
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import traceback
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_redis import FakeRedis  # noqa: E402
+
+NOW = "2026-01-01T00:00:00"
+LATER = "2026-01-01T00:10:00"
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+
+@check
+async def reserve_is_exclusive(storage):
+    expect(await storage.reserve("u1", 1, NOW), True, "first reserve")
+    expect(await storage.reserve("u1", 1, NOW), False, "second reserve, same chat")
+    expect(await storage.reserve("u1", 2, NOW), False, "second reserve, other chat")
+
+
+@check
+async def concurrent_reserves_have_one_winner(storage):
+    results = await asyncio.gather(*(storage.reserve("race", chat_id, NOW) for chat_id in range(1, 21)))
+    expect(results.count(True), 1, "winning reserves")
+
+
+@check
+async def unreserve_releases_user(storage):
+    await storage.reserve("u1", 1, NOW)
+    await storage.unreserve("u1")
+    await storage.flush()
+    expect(await storage.history_count(0), 0, "total after unreserve")
+    expect(await storage.history_count(1), 0, "chat count after unreserve")
+    expect(await storage.reserve("u1", 2, NOW), True, "reserve after unreserve")
+
+
+@check
+async def mark_keeps_user(storage):
+    await storage.reserve("u1", 1, NOW)
+    await storage.mark("u1", 1, NOW)
+    await storage.unreserve("u1")
+    await storage.mark("u2", 1, NOW)
+    await storage.flush()
+    expect(await storage.reserve("u1", 1, NOW), False, "reserve after mark")
+    expect(await storage.reserve("u2", 1, NOW), False, "reserve after mark without reserve")
+    expect(await storage.history_count(0), 2, "total")
+
+
+@check
+async def losing_reserve_leaves_no_trace(storage):
+    await storage.mark("u1", 1, NOW)
+    await storage.reserve("u2", 1, NOW)
+    await storage.flush()
+    expect(await storage.reserve("u1", 2, NOW), False, "reserve of marked user")
+    expect(await storage.reserve("u2", 2, NOW), False, "reserve of reserved user")
+    await storage.flush()
+    expect(await storage.history_count(2), 0, "losing chat count")
+    expect(await storage.expire(LATER, 100, reserved_only=True), ["u2"], "reservations left to expire")
+
+
+@check
+async def import_rows_marks_users(storage):
+    await storage.reserve("u1", 1, NOW)
+    await storage.flush()
+    rows = [("u1", 1, NOW), ("u2", 1, NOW), ("u2", 2, NOW)]
+    expect(await storage.import_rows(rows), 2, "new chat memberships")
+    expect(await storage.import_rows(rows), 0, "memberships on a second import")
+    await storage.flush()
+    expect(await storage.history_count(0), 2, "total")
+    expect(await storage.history_count(2), 1, "chat 2")
+    expect(await storage.reserve("u2", 3, NOW), False, "reserve imported user")
+    expect(await storage.expire(LATER, 100, reserved_only=True), [], "reservations left after import")
+
+
+@check
+async def counts_per_chat(storage):
+    for i in range(3):
+        await storage.reserve(f"a{i}", 1, NOW)
+    for i in range(2):
+        await storage.mark(f"b{i}", 2, NOW)
+    await storage.flush()
+    expect(await storage.history_count(0), 5, "total")
+    expect(await storage.history_count(1), 3, "chat 1")
+    expect(await storage.history_count(2), 2, "chat 2")
+    expect(await storage.history_count(3), 0, "unknown chat")
+
+
+@check
+async def expire_drops_stale_reservations_only(storage):
+    await storage.reserve("old", 1, NOW)
+    await storage.reserve("kept", 1, NOW)
+    await storage.mark("kept", 1, NOW)
+    await storage.reserve("new", 1, LATER)
+    await storage.flush()
+    expect(await storage.expire("2026-01-01T00:05:00", 100, reserved_only=True), ["old"], "expired")
+    expect(await storage.history_count(1), 2, "chat count after expire")
+    expect(await storage.reserve("old", 1, LATER), True, "reserve after expire")
+
+
+@check
+async def iter_user_ids_sees_everyone(storage):
+    expected = {f"u{i}" for i in range(25)}
+    for user_id in expected:
+        await storage.mark(user_id, 1, NOW)
+    await storage.flush()
+    seen = []
+    async for user_ids in storage.iter_user_ids(7):
+        seen.extend(user_ids)
+    expect(sorted(seen), sorted(expected), "user ids")
+
+
+@check
+async def clear_chat_keeps_shared_users(storage):
+    await storage.mark("only1", 1, NOW)
+    await storage.mark("both", 1, NOW)
+    await storage.mark("both", 2, NOW)
+    await storage.mark("only2", 2, NOW)
+    await storage.flush()
+    await storage.clear_history(1)
+    expect(await storage.history_count(1), 0, "cleared chat")
+    expect(await storage.history_count(2), 2, "other chat")
+    expect(await storage.history_count(0), 2, "total")
+    expect(await storage.reserve("only1", 3, NOW), True, "reserve user only the cleared chat had")
+    expect(await storage.reserve("both", 3, NOW), False, "reserve user another chat still has")
+
+
+@check
+async def clear_all(storage):
+    await storage.mark("u1", 1, NOW)
+    await storage.reserve("u2", 2, NOW)
+    await storage.flush()
+    await storage.clear_history()
+    expect(await storage.history_count(0), 0, "total")
+    expect(await storage.history_count(1), 0, "chat count")
+    expect(await storage.reserve("u1", 1, NOW), True, "reserve after clear")
+    await storage.mark("u3", 1, NOW)
+    await storage.flush()
+    expect(await storage.history_count(0), 2, "total after clear and new users")
+    await storage.unreserve("u1")
+    await storage.flush()
+    expect(await storage.history_count(0), 1, "total after unreserve")
+    expect(await storage.history_count(1), 1, "chat count after unreserve")
+
+
+@check
+async def config_values(storage):
+    expect(await storage.get_config("missing"), None, "missing key")
+    await storage.set_config("k", "1")
+    await storage.set_config("k", "0")
+    expect(await storage.get_config("k"), "0", "overwritten key")
+
+
+@check
+async def excluded_countries(storage):
+    expect(await storage.list_excluded(7), [], "empty filter")
+    await storage.add_excluded(7, ["US", "KR"])
+    await storage.add_excluded(7, ["KR", "JP"])
+    await storage.add_excluded(8, ["DE"])
+    expect(await storage.list_excluded(7), ["JP", "KR", "US"], "filter")
+    await storage.clear_excluded(7)
+    expect(await storage.list_excluded(7), [], "cleared filter")
+    expect(await storage.list_excluded(8), ["DE"], "other chat's filter")
+
+
+async def reset(storage):
+    await storage.clear_history()
+    for chat_id in (7, 8):
+        await storage.clear_excluded(chat_id)
+
+
+async def run_suite(db, name):
+    storage = db.storage
+    failures = 0
+    for fn in CHECKS:
+        await reset(storage)
+        await storage.flush()
+        try:
+            await fn(storage)
+        except Exception:
+            failures += 1
+            print(f"FAIL {name:<7} {fn.__name__}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {name:<7} {fn.__name__}")
+    await reset(storage)
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", action="append", choices=("sqlite", "redis"), help="default: all")
+    parser.add_argument("--redis-url", help="real server to test against instead of the local stand-in")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mquick-storage-"), "storage.db")
+    os.environ.setdefault("STORAGE_PREFIX", "mquick-conformance:")
+    from mquick import db
+
+    await db.init_db()
+    db.history_writer.start()
+    failures = 0
+    fake = None
+    try:
+        for backend in args.backend or ("sqlite", "redis"):
+            url = None
+            if backend == "redis":
+                url = args.redis_url
+                if url is None:
+                    fake = await FakeRedis().start()
+                    url = fake.url
+            await db.storage.close()
+            await db.open_storage(backend, url)
+            failures += await run_suite(db, backend)
+    finally:
+        await db.history_writer.close()
+        await db.close_db()
+        if fake is not None:
+            await fake.stop()
+    print(f"{failures} failed" if failures else "all backends conform")
+    return failures
+
+
+def main_cli(argv=None):
+    sys.exit(1 if asyncio.run(run(parse_args(argv))) else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
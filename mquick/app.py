@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import sys
+import time
+
+from .metrics import metrics
+from .runtime import loop_monitor, run
+from .settings import BOT_MODE, BOT_TOKEN, LOOP_LAG_INTERVAL, METRICS_PORT, WORKER_PROCESSES
+
+logger = logging.getLogger("mquick")
+
+# aiogram, aiohttp.web and the worker machinery are imported by the code
+# paths that need them, so the history CLI and benchmarks start quickly
+
+async def _time_updates(handler, event, data):
+    start = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        metrics.observe("mquick_update_seconds", time.perf_counter() - start, mode=BOT_MODE, type=event.event_type)
+
+def create_bot(token=None):
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    token = token or BOT_TOKEN
+    if not token:
+        raise RuntimeError("BOT_TOKEN environment variable is required")
+    return Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
+
+def create_dispatcher():
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from .handlers import router
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.update.outer_middleware(_time_updates)
+    dp.include_router(router)
+    return dp
+
+def create_app(token=None):
+    from . import matching
+    bot = create_bot(token)
+    dp = create_dispatcher()
+    matching.bot = bot
+    return bot, dp
+
+async def register_bot_commands(bot):
+    from aiogram.types import BotCommand
+    commands = [
+        BotCommand(command="start", description="Start and send Meeff token"),
+        BotCommand(command="countries", description="Manage countries filter"),
+        BotCommand(command="history", description="Show history stats"),
+    ]
+    await bot.set_my_commands(commands)
+
+async def main():
+    from . import matching
+    from .db import close_db, history_cache, history_writer, init_db, maintenance_loop
+    from .matching import http_sessions, resume_tasks, stop_all_tasks, task_checkpoint_loop
+    from .metrics import start_metrics_server
+    logging.basicConfig(level=logging.INFO)
+    bot, dp = create_app()
+    await init_db()
+    await history_cache.load()
+    history_writer.start()
+    if WORKER_PROCESSES > 0:
+        from .workers import WorkerPool
+        matching.worker_pool = WorkerPool(WORKER_PROCESSES)
+        await matching.worker_pool.start()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    checkpoint_task = asyncio.create_task(task_checkpoint_loop())
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    resume_task = asyncio.create_task(resume_tasks())
+    lag_task = asyncio.create_task(loop_monitor.run()) if LOOP_LAG_INTERVAL > 0 else None
+    try:
+        await register_bot_commands(bot)
+        if BOT_MODE == "webhook":
+            from .webhook import run_webhook
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        resume_task.cancel()
+        checkpoint_task.cancel()
+        maintenance_task.cancel()
+        if lag_task:
+            lag_task.cancel()
+        await stop_all_tasks()
+        await http_sessions.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await history_writer.close()
+        await close_db()
+        await bot.session.close()
+
+HISTORY_CLI_EPILOG = """\
+moving from STORAGE_BACKEND=sqlite to redis:
+  main.py history export history.ndjson.gz
+  main.py history export-settings settings.json
+  STORAGE_BACKEND=redis main.py history import history.ndjson.gz
+  STORAGE_BACKEND=redis main.py history import-settings settings.json
+exports read the local SQLite database; imports write to the configured backend
+"""
+
+async def history_cli(argv):
+    import argparse
+    from .db import close_db, export_history, export_settings, import_history, import_settings, init_db
+    parser = argparse.ArgumentParser(
+        prog="main.py history", epilog=HISTORY_CLI_EPILOG, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("action", choices=("export", "import", "export-settings", "import-settings"))
+    parser.add_argument("path", help="history file (.csv or .ndjson, optionally .gz) or settings .json file")
+    parser.add_argument("--chat", type=int, help="export only this chat / import all rows into this chat")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    await init_db()
+    try:
+        if args.action == "export":
+            total = await export_history(args.path, args.chat)
+            print(f"exported {total} rows to {args.path}")
+        elif args.action == "import":
+            read, added = await import_history(args.path, args.chat)
+            print(f"imported {added} new rows ({read} read) from {args.path}; restart the bot to reload its cache")
+        elif args.action == "export-settings":
+            keys, chats = await export_settings(args.path)
+            print(f"exported {keys} config values and {chats} country filters to {args.path}")
+        else:
+            keys, chats = await import_settings(args.path)
+            print(f"imported {keys} config values and {chats} country filters from {args.path}")
+    finally:
+        await close_db()
+
+def cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--worker" in argv:
+        from .workers import worker_main
+        run(worker_main())
+    elif argv[:1] == ["history"]:
+        run(history_cli(argv[1:]))
+    else:
+        run(main())
@@ -0,0 +1,1145 @@
+import asyncio
+import csv
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import struct
+import time
+from array import array
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import aiosqlite
+
+from .metrics import db_timed, metrics
+from .settings import (
+    HISTORY_CACHE_BYTES,
+    HISTORY_CACHE_ENTRY_BYTES,
+    HISTORY_EXPORT_CHUNK,
+    HISTORY_MIGRATION_CHUNK,
+    HISTORY_RETENTION_DAYS,
+    HISTORY_WRITE_BATCH,
+    HISTORY_WRITE_WINDOW,
+    MAINTENANCE_CHUNK,
+    MAINTENANCE_INTERVAL,
+    MAINTENANCE_PAUSE,
+    MAINTENANCE_VACUUM_PAGES,
+    RESERVED_STALE_SECONDS,
+    SQLITE_PATH,
+    SQLITE_READERS,
+    STORAGE_BACKEND,
+    STORAGE_SETTINGS_TTL,
+    STORAGE_URL,
+)
+
+logger = logging.getLogger("mquick")
+
+sql_db = None
+# the writer connection has one transaction at a time; the history writer's
+# batches and every helper that commits on sql_db take this lock, so no
+# commit or rollback lands in the middle of someone else's statements
+write_lock = asyncio.Lock()
+
+class ReadPool:
+    def __init__(self, size=SQLITE_READERS):
+        self.size = size
+        self.queue = None
+        self.conns = []
+
+    async def open(self, path=None):
+        path = path or SQLITE_PATH
+        if self.size <= 0 or path == ":memory:":
+            return
+        self.queue = asyncio.Queue()
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(uri, uri=True, timeout=30)
+            await conn.execute("PRAGMA query_only=1;")
+            self.conns.append(conn)
+            self.queue.put_nowait(conn)
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.queue is None:
+            yield sql_db
+            return
+        conn = await self.queue.get()
+        try:
+            yield conn
+        finally:
+            self.queue.put_nowait(conn)
+
+    async def close(self):
+        conns, self.conns, self.queue = self.conns, [], None
+        for conn in conns:
+            await conn.close()
+
+read_pool = ReadPool()
+
+async def init_db():
+    global sql_db
+    sql_db = await aiosqlite.connect(SQLITE_PATH, timeout=30)
+    await sql_db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    await sql_db.execute("PRAGMA journal_mode=WAL;")
+    await sql_db.execute("PRAGMA synchronous=NORMAL;")
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """
+    )
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS exclude (
+            chat_id INTEGER,
+            country TEXT,
+            PRIMARY KEY(chat_id, country)
+        );
+        """
+    )
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history (
+            user_id TEXT PRIMARY KEY,
+            first_added_at TEXT,
+            added_by TEXT,
+            reserved INTEGER DEFAULT 0
+        );
+        """
+    )
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_chat (
+            user_id TEXT,
+            chat_id INTEGER,
+            added_at TEXT,
+            PRIMARY KEY(user_id, chat_id)
+        );
+        """
+    )
+    await sql_db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_chat_chat_added_user ON history_chat(chat_id, added_at, user_id)"
+    )
+    await sql_db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_first_added ON history(first_added_at)"
+    )
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            task_id TEXT PRIMARY KEY,
+            chat_id INTEGER,
+            started_at TEXT,
+            ended_at TEXT,
+            duration REAL,
+            requests INTEGER,
+            cycles INTEGER,
+            errors INTEGER,
+            stop_reason TEXT
+        );
+        """
+    )
+    await sql_db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_runs_ended ON runs(ended_at)"
+    )
+    await sql_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            chat_id INTEGER,
+            token TEXT,
+            explore_url TEXT,
+            stat_message_id INTEGER,
+            requests INTEGER DEFAULT 0,
+            cycles INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            started_at TEXT,
+            updated_at TEXT
+        );
+        """
+    )
+    await sql_db.commit()
+    await migrate_schema()
+    await read_pool.open()
+    await open_storage()
+
+async def open_storage(backend=STORAGE_BACKEND, url=STORAGE_URL):
+    global storage
+    storage = create_storage(backend, url)
+    await storage.open()
+    if storage.shared and HISTORY_RETENTION_DAYS > 0:
+        logger.warning("HISTORY_RETENTION_DAYS only applies to the sqlite storage backend")
+    if storage.shared and not await storage.history_count(0):
+        async with sql_db.execute("SELECT count FROM history_counts WHERE chat_id = 0") as cur:
+            row = await cur.fetchone()
+        if row and row[0]:
+            logger.warning(
+                "%s storage has no history but the local SQLite database holds %d users; "
+                "see 'main.py history --help' to move history and settings across",
+                storage.name, row[0],
+            )
+
+async def close_db():
+    await storage.close()
+    await read_pool.close()
+    await sql_db.close()
+
+async def get_schema_version():
+    async with sql_db.execute("PRAGMA user_version") as cur:
+        row = await cur.fetchone()
+        return row[0] if row else 0
+
+async def set_schema_version(version):
+    await sql_db.execute(f"PRAGMA user_version = {int(version)}")
+    await sql_db.commit()
+
+async def migrate_schema():
+    version = await get_schema_version()
+    if version < 1:
+        await migrate_history_chat()
+        await set_schema_version(1)
+    if version < 2:
+        await migrate_history_counts()
+        await set_schema_version(2)
+    if version < 3:
+        await migrate_runs_idle()
+        await set_schema_version(3)
+    if version < 4:
+        await migrate_history_chat_index()
+        await set_schema_version(4)
+
+async def migrate_history_chat_index():
+    # per-chat export pages ORDER BY added_at, user_id; with user_id in the
+    # index that is an index walk instead of a temp B-tree sort per page
+    await sql_db.executescript(
+        """
+        BEGIN;
+        CREATE INDEX IF NOT EXISTS idx_history_chat_chat_added_user ON history_chat(chat_id, added_at, user_id);
+        DROP INDEX IF EXISTS idx_history_chat_chat_added;
+        COMMIT;
+        """
+    )
+
+async def migrate_runs_idle():
+    await sql_db.executescript(
+        """
+        BEGIN;
+        ALTER TABLE runs ADD COLUMN idle REAL DEFAULT 0;
+        ALTER TABLE runs ADD COLUMN empty_polls INTEGER DEFAULT 0;
+        COMMIT;
+        """
+    )
+
+HISTORY_COUNT_DELETE_TRIGGERS = """
+        CREATE TRIGGER IF NOT EXISTS history_counts_delete AFTER DELETE ON history BEGIN
+            UPDATE history_counts SET count = count - 1 WHERE chat_id = 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS history_chat_counts_delete AFTER DELETE ON history_chat BEGIN
+            UPDATE history_counts SET count = count - 1 WHERE chat_id = OLD.chat_id;
+        END;
+"""
+
+async def migrate_history_counts():
+    # chat_id 0 holds the total; Telegram never assigns chat id 0
+    await sql_db.executescript(
+        """
+        BEGIN;
+        CREATE TABLE IF NOT EXISTS history_counts (
+            chat_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        );
+        DELETE FROM history_counts;
+        INSERT INTO history_counts(chat_id, count) SELECT 0, COUNT(*) FROM history;
+        INSERT INTO history_counts(chat_id, count) SELECT chat_id, COUNT(*) FROM history_chat GROUP BY chat_id;
+        CREATE TRIGGER IF NOT EXISTS history_counts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_counts(chat_id, count) VALUES(0, 1)
+                ON CONFLICT(chat_id) DO UPDATE SET count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS history_chat_counts_insert AFTER INSERT ON history_chat BEGIN
+            INSERT INTO history_counts(chat_id, count) VALUES(NEW.chat_id, 1)
+                ON CONFLICT(chat_id) DO UPDATE SET count = count + 1;
+        END;
+        """
+        + HISTORY_COUNT_DELETE_TRIGGERS
+        + "COMMIT;"
+    )
+
+async def migrate_history_chat():
+    # chunked by rowid and checkpointed in config so it can resume after a restart
+    last_rowid = int((await get_config_value("migrate:history_chat:rowid")) or 0)
+    while True:
+        async with sql_db.execute(
+            "SELECT rowid, user_id, first_added_at, added_by FROM history WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, HISTORY_MIGRATION_CHUNK),
+        ) as cur:
+            rows = await cur.fetchall()
+        if not rows:
+            break
+        pairs = []
+        for rowid, user_id, added_at, added_by in rows:
+            for part in (added_by or "").split(","):
+                part = part.strip()
+                if not part:
+                    continue
+                try:
+                    pairs.append((user_id, int(part), added_at))
+                except ValueError:
+                    continue
+        last_rowid = rows[-1][0]
+        await sql_db.executemany(
+            "INSERT OR IGNORE INTO history_chat(user_id, chat_id, added_at) VALUES(?, ?, ?)",
+            pairs,
+        )
+        await sql_db.execute(
+            "INSERT INTO config(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            ("migrate:history_chat:rowid", str(last_rowid)),
+        )
+        await sql_db.commit()
+        await asyncio.sleep(0)
+    await sql_db.execute("DELETE FROM config WHERE key = ?", ("migrate:history_chat:rowid",))
+    await sql_db.commit()
+
+@db_timed
+async def get_config_value(key):
+    return await storage.get_config(key)
+
+@db_timed
+async def set_config_value(key, value):
+    await storage.set_config(key, value)
+
+async def get_config_bool(key, default=False):
+    v = await get_config_value(key)
+    if v is None:
+        return default
+    return v == "1"
+
+async def set_config_bool(key, val):
+    await set_config_value(key, "1" if val else "0")
+
+@db_timed
+async def list_excluded_countries(chat_id):
+    return await storage.list_excluded(chat_id)
+
+@db_timed
+async def add_excluded_countries(chat_id, countries):
+    await storage.add_excluded(chat_id, countries)
+    invalidate_chat_settings(chat_id)
+
+@db_timed
+async def clear_excluded_countries(chat_id):
+    await storage.clear_excluded(chat_id)
+    invalidate_chat_settings(chat_id)
+
+@functools.lru_cache(maxsize=4096)
+def normalize_country(value):
+    if not value:
+        return None
+    code = value.upper()
+    if "-" in code:
+        code = code.split("-")[-1]
+    return code
+
+class CountryFilter:
+    __slots__ = ("enabled", "mode", "countries")
+
+    def __init__(self, enabled, mode, countries):
+        self.enabled = enabled
+        self.mode = mode
+        self.countries = countries
+
+    def select(self, users):
+        norm = normalize_country
+        countries = self.countries
+        if not self.enabled:
+            return [u.user_id for u in users if u.user_id]
+        if self.mode == "exclude":
+            return [u.user_id for u in users if u.user_id and norm(u.nationality_code or u.locale) not in countries]
+        return [u.user_id for u in users if u.user_id and norm(u.nationality_code or u.locale) in countries]
+
+@dataclass
+class ChatSettings:
+    countries_enabled: bool = True
+    countries_mode: str = "exclude"
+    countries: frozenset = field(default_factory=frozenset)
+    history_enabled: bool = True
+    country_filter: CountryFilter = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.country_filter = CountryFilter(self.countries_enabled, self.countries_mode, self.countries)
+
+chat_settings = {}
+chat_settings_version = {}
+
+async def load_chat_settings(chat_id):
+    return ChatSettings(
+        countries_enabled=await get_config_bool(f"countries_enabled:{chat_id}", default=True),
+        countries_mode=(await get_config_value(f"countries_mode:{chat_id}")) or "exclude",
+        countries=frozenset(c.upper() for c in await list_excluded_countries(chat_id)),
+        history_enabled=await get_config_bool(f"history_enabled:{chat_id}", default=True),
+    )
+
+async def get_chat_settings(chat_id):
+    cached = chat_settings.get(chat_id)
+    now = time.monotonic()
+    # another replica may change a shared backend, so its settings go stale
+    if cached is not None and (not storage.shared or now - cached[1] < STORAGE_SETTINGS_TTL):
+        return cached[0]
+    version = chat_settings_version.get(chat_id, 0)
+    settings = await load_chat_settings(chat_id)
+    if chat_settings_version.get(chat_id, 0) == version:
+        chat_settings[chat_id] = (settings, now)
+    return settings
+
+def notify_workers(message, chat_id=None):
+    # worker processes hold their own settings and history caches
+    from .matching import worker_pool
+    if worker_pool is None:
+        return
+    if chat_id is None:
+        worker_pool.broadcast(message)
+    else:
+        worker_pool.send_to_chat(chat_id, message)
+
+def invalidate_chat_settings(chat_id):
+    chat_settings_version[chat_id] = chat_settings_version.get(chat_id, 0) + 1
+    chat_settings.pop(chat_id, None)
+    notify_workers({"op": "settings", "chat_id": chat_id}, chat_id=chat_id)
+
+@db_timed
+async def _apply_reserve(user_id, chat_id, now):
+    cur = await sql_db.execute(
+        "INSERT OR IGNORE INTO history(user_id, first_added_at, reserved) VALUES(?, ?, 1)",
+        (user_id, now),
+    )
+    if not cur.rowcount:
+        return False
+    await sql_db.execute(
+        "INSERT OR IGNORE INTO history_chat(user_id, chat_id, added_at) VALUES(?, ?, ?)",
+        (user_id, chat_id, now),
+    )
+    return True
+
+@db_timed
+async def _apply_mark(user_id, chat_id, now):
+    await sql_db.execute(
+        "INSERT INTO history(user_id, first_added_at, reserved) VALUES(?, ?, 0) "
+        "ON CONFLICT(user_id) DO UPDATE SET reserved = 0",
+        (user_id, now),
+    )
+    await sql_db.execute(
+        "INSERT OR IGNORE INTO history_chat(user_id, chat_id, added_at) VALUES(?, ?, ?)",
+        (user_id, chat_id, now),
+    )
+
+@db_timed
+async def _apply_unreserve(user_id):
+    cur = await sql_db.execute("DELETE FROM history WHERE user_id = ? AND reserved = 1", (user_id,))
+    if cur.rowcount:
+        await sql_db.execute("DELETE FROM history_chat WHERE user_id = ?", (user_id,))
+
+@db_timed
+async def _apply_expire(cutoff, limit, reserved_only=False):
+    query = "SELECT user_id FROM history WHERE first_added_at < ?"
+    if reserved_only:
+        query += " AND reserved = 1"
+    async with sql_db.execute(query + " LIMIT ?", (cutoff, limit)) as cur:
+        user_ids = [row[0] for row in await cur.fetchall()]
+    if user_ids:
+        params = [(user_id,) for user_id in user_ids]
+        await sql_db.executemany("DELETE FROM history WHERE user_id = ?", params)
+        await sql_db.executemany("DELETE FROM history_chat WHERE user_id = ?", params)
+    return user_ids
+
+@db_timed
+async def _apply_vacuum(pages):
+    await sql_db.execute("PRAGMA optimize;")
+    async with sql_db.execute("PRAGMA auto_vacuum") as cur:
+        row = await cur.fetchone()
+    if row and row[0] == 2:
+        async with sql_db.execute(f"PRAGMA incremental_vacuum({int(pages)})") as cur:
+            await cur.fetchall()
+        return True
+    return False
+
+@db_timed
+async def _apply_import(rows):
+    await sql_db.executemany(
+        "INSERT INTO history(user_id, first_added_at, reserved) VALUES(?, ?, 0) "
+        "ON CONFLICT(user_id) DO UPDATE SET reserved = 0, first_added_at = min(first_added_at, excluded.first_added_at)",
+        [(user_id, added_at) for user_id, _, added_at in rows],
+    )
+    cur = await sql_db.executemany(
+        "INSERT OR IGNORE INTO history_chat(user_id, chat_id, added_at) VALUES(?, ?, ?)",
+        rows,
+    )
+    return cur.rowcount
+
+async def _apply_flush():
+    return None
+
+HISTORY_OPS = {
+    "reserve": _apply_reserve,
+    "mark": _apply_mark,
+    "unreserve": _apply_unreserve,
+    "expire": _apply_expire,
+    "vacuum": _apply_vacuum,
+    "import": _apply_import,
+    "flush": _apply_flush,
+}
+
+class HistoryWriter:
+    def __init__(self, max_batch=HISTORY_WRITE_BATCH, window=HISTORY_WRITE_WINDOW):
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.flushes = 0
+        self.ops = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def submit(self, op, *args, wait=True):
+        if self.task is None:
+            async with write_lock:
+                result = await HISTORY_OPS[op](*args)
+                await sql_db.commit()
+            return result
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        await self.queue.put((op, args, fut))
+        if fut is not None:
+            return await fut
+
+    async def flush(self):
+        await self.submit("flush")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self.queue.get()
+            if item is None:
+                break
+            # group commit: take what is already queued and commit straight
+            # away; the window only caps how long a batch keeps growing
+            # while ops keep arriving
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch and batch[-1][0] != "flush" and loop.time() < deadline:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # let producers that are already runnable add their ops
+                    await asyncio.sleep(0)
+                    if self.queue.empty():
+                        break
+                    continue
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            await self._apply(batch)
+
+    async def _apply(self, batch):
+        async with write_lock:
+            await self._apply_locked(batch)
+
+    async def _apply_locked(self, batch):
+        results = []
+        try:
+            for op, args, fut in batch:
+                results.append(await HISTORY_OPS[op](*args))
+            start = time.perf_counter()
+            await sql_db.commit()
+            metrics.observe("mquick_db_query_seconds", time.perf_counter() - start, helper="history_writer_commit")
+        except Exception:
+            try:
+                await sql_db.rollback()
+            except Exception:
+                pass
+            await self._apply_each(batch)
+            return
+        self.flushes += 1
+        self.ops += len(batch)
+        for (op, args, fut), result in zip(batch, results):
+            if fut is not None and not fut.done():
+                fut.set_result(result)
+
+    async def _apply_each(self, batch):
+        for op, args, fut in batch:
+            try:
+                result = await HISTORY_OPS[op](*args)
+                await sql_db.commit()
+            except Exception as e:
+                try:
+                    await sql_db.rollback()
+                except Exception:
+                    pass
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+                elif fut is None:
+                    logger.error("history %s op failed for %r", op, args, exc_info=e)
+                continue
+            self.flushes += 1
+            self.ops += 1
+            if fut is not None and not fut.done():
+                fut.set_result(result)
+
+# two bit positions (6 bits each) per 12-bit index
+BLOOM_PAIR_MASKS = [(1 << (i & 63)) | (1 << (i >> 6)) for i in range(4096)]
+
+class BloomFilter:
+    # blocked Bloom filter: one 128-bit blake2b digest picks a 64-bit word
+    # and up to eight bits in it through a table of two-bit masks, so an add
+    # or lookup touches one word and does no per-bit Python work
+    def __init__(self, size_bytes):
+        words = 1 << max(0, (max(size_bytes, 8) // 8).bit_length() - 1)
+        self.size = words * 64
+        self.words = array("Q", bytes(words * 8))
+        self.word_mask = words - 1
+        self.unpack = struct.Struct("<QQ").unpack
+
+    def _locate(self, item):
+        low, high = self.unpack(hashlib.blake2b(item.encode(), digest_size=16).digest())
+        masks = BLOOM_PAIR_MASKS
+        mask = masks[high & 4095] | masks[high >> 12 & 4095] | masks[high >> 24 & 4095] | masks[high >> 36 & 4095]
+        return low & self.word_mask, mask
+
+    def add(self, item):
+        index, mask = self._locate(item)
+        self.words[index] |= mask
+
+    def update(self, items):
+        words, word_mask, unpack, blake2b, masks = self.words, self.word_mask, self.unpack, hashlib.blake2b, BLOOM_PAIR_MASKS
+        for item in items:
+            low, high = unpack(blake2b(item.encode(), digest_size=16).digest())
+            words[low & word_mask] |= (
+                masks[high & 4095] | masks[high >> 12 & 4095] | masks[high >> 24 & 4095] | masks[high >> 36 & 4095]
+            )
+
+    def __contains__(self, item):
+        index, mask = self._locate(item)
+        return self.words[index] & mask == mask
+
+class HistoryCache:
+    # exact set while the history fits in the memory budget, Bloom filter
+    # beyond it; Bloom false positives are skipped like already-seen users
+    def __init__(self, budget_bytes=HISTORY_CACHE_BYTES):
+        self.budget_bytes = budget_bytes
+        self.exact = set()
+        self.bloom = None
+        self.removed = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _fits(self, count):
+        return count * HISTORY_CACHE_ENTRY_BYTES <= self.budget_bytes
+
+    def _to_bloom(self):
+        self.bloom = BloomFilter(self.budget_bytes)
+        self.bloom.update(self.exact)
+        self.exact = set()
+        self.removed = set()
+
+    def reset(self):
+        self.exact = set()
+        self.bloom = None
+        self.removed = set()
+
+    async def load(self):
+        self.reset()
+        total = await history_total_count()
+        if not self._fits(total):
+            self.bloom = BloomFilter(self.budget_bytes)
+        async for user_ids in storage.iter_user_ids(HISTORY_MIGRATION_CHUNK):
+            if self.bloom is not None:
+                self.bloom.update(user_ids)
+                continue
+            self.exact.update(user_ids)
+            if not self._fits(len(self.exact)):
+                self._to_bloom()
+
+    async def drop(self, user_ids):
+        # exact mode forgets just these ids; a Bloom filter can't remove
+        # members, so it is rebuilt from the remaining history instead
+        if self.bloom is None:
+            self.exact.difference_update(user_ids)
+        else:
+            await history_writer.flush()
+            await self.load()
+
+    def add(self, user_id):
+        if self.bloom is not None:
+            self.bloom.add(user_id)
+            self.removed.discard(user_id)
+            return
+        self.exact.add(user_id)
+        if not self._fits(len(self.exact)):
+            self._to_bloom()
+
+    def discard(self, user_id):
+        if self.bloom is not None:
+            self.removed.add(user_id)
+        else:
+            self.exact.discard(user_id)
+
+    def __contains__(self, user_id):
+        if self.bloom is not None:
+            found = user_id not in self.removed and user_id in self.bloom
+        else:
+            found = user_id in self.exact
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+history_writer = HistoryWriter()
+history_cache = HistoryCache()
+
+class SqliteStorage:
+    # history, config and country filters in the local database; writes to
+    # the history go through the batching history writer
+    name = "sqlite"
+    shared = False
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def flush(self):
+        await history_writer.flush()
+
+    async def reserve(self, user_id, chat_id, now):
+        return await history_writer.submit("reserve", user_id, chat_id, now)
+
+    async def mark(self, user_id, chat_id, now):
+        await history_writer.submit("mark", user_id, chat_id, now, wait=False)
+
+    async def unreserve(self, user_id):
+        await history_writer.submit("unreserve", user_id, wait=False)
+
+    async def import_rows(self, rows):
+        return await history_writer.submit("import", rows)
+
+    async def expire(self, cutoff, limit, reserved_only=False):
+        return await history_writer.submit("expire", cutoff, limit, reserved_only)
+
+    async def history_count(self, chat_id=0):
+        async with read_pool.acquire() as db:
+            async with db.execute("SELECT count FROM history_counts WHERE chat_id = ?", (chat_id,)) as cur:
+                row = await cur.fetchone()
+                return row[0] if row else 0
+
+    async def iter_user_ids(self, chunk):
+        async with read_pool.acquire() as db:
+            async with db.execute("SELECT user_id FROM history") as cur:
+                while True:
+                    rows = await cur.fetchmany(chunk)
+                    if not rows:
+                        return
+                    yield [row[0] for row in rows]
+
+    async def clear_history(self, chat_id=None):
+        # returns the user ids removed from the shared history for a per-chat
+        # clear, None when everything was cleared
+        await history_writer.flush()
+        dropped = None
+        async with write_lock:
+            if chat_id is None:
+                # with delete triggers in place SQLite runs one UPDATE per
+                # row; without them an unqualified DELETE truncates the table
+                await sql_db.executescript(
+                    """
+                    BEGIN;
+                    DROP TRIGGER IF EXISTS history_counts_delete;
+                    DROP TRIGGER IF EXISTS history_chat_counts_delete;
+                    DELETE FROM history;
+                    DELETE FROM history_chat;
+                    DELETE FROM history_counts WHERE chat_id != 0;
+                    UPDATE history_counts SET count = 0 WHERE chat_id = 0;
+                    """
+                    + HISTORY_COUNT_DELETE_TRIGGERS
+                    + "COMMIT;"
+                )
+            else:
+                async with sql_db.execute(
+                    "SELECT user_id FROM history_chat WHERE chat_id = ? "
+                    "AND NOT EXISTS (SELECT 1 FROM history_chat hc WHERE hc.user_id = history_chat.user_id AND hc.chat_id != ?)",
+                    (chat_id, chat_id),
+                ) as cur:
+                    dropped = [row[0] for row in await cur.fetchall()]
+                for i in range(0, len(dropped), 500):
+                    batch = dropped[i:i + 500]
+                    await sql_db.execute(
+                        f"DELETE FROM history WHERE user_id IN ({','.join('?' * len(batch))})", batch
+                    )
+                await sql_db.execute("DELETE FROM history_chat WHERE chat_id = ?", (chat_id,))
+                await sql_db.execute("DELETE FROM history_counts WHERE chat_id = ? AND count = 0", (chat_id,))
+            await sql_db.commit()
+        return dropped
+
+    async def get_config(self, key):
+        async with read_pool.acquire() as db:
+            async with db.execute("SELECT value FROM config WHERE key = ?", (key,)) as cur:
+                row = await cur.fetchone()
+                return row[0] if row else None
+
+    async def set_config(self, key, value):
+        async with write_lock:
+            await sql_db.execute(
+                "INSERT INTO config(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+            await sql_db.commit()
+
+    async def list_excluded(self, chat_id):
+        async with read_pool.acquire() as db:
+            async with db.execute("SELECT country FROM exclude WHERE chat_id = ? ORDER BY country", (chat_id,)) as cur:
+                rows = await cur.fetchall()
+                return [r[0] for r in rows]
+
+    async def add_excluded(self, chat_id, countries):
+        async with write_lock:
+            await sql_db.executemany(
+                "INSERT OR IGNORE INTO exclude(chat_id, country) VALUES(?, ?)",
+                [(chat_id, c) for c in countries],
+            )
+            await sql_db.commit()
+
+    async def clear_excluded(self, chat_id):
+        async with write_lock:
+            await sql_db.execute("DELETE FROM exclude WHERE chat_id = ?", (chat_id,))
+            await sql_db.commit()
+
+def create_storage(backend=STORAGE_BACKEND, url=STORAGE_URL):
+    if backend == "sqlite":
+        return SqliteStorage()
+    if backend == "redis":
+        from .redis_storage import RedisStorage
+        return RedisStorage(url)
+    raise RuntimeError(f"unknown STORAGE_BACKEND {backend!r}")
+
+storage = SqliteStorage()
+
+history_checked_at = 0.0
+
+async def sync_history_cache():
+    # another replica's clear or expiry removes users from a shared backend
+    # that this process's cache would otherwise keep skipping
+    global history_checked_at
+    now = time.monotonic()
+    if not storage.shared or now - history_checked_at < STORAGE_SETTINGS_TTL:
+        return
+    history_checked_at = now
+    if await storage.history_changed():
+        await history_cache.load()
+
+async def reserve_user(user_id, chat_id):
+    await sync_history_cache()
+    if user_id in history_cache:
+        return False
+    reserved = await storage.reserve(user_id, chat_id, datetime.utcnow().isoformat())
+    history_cache.add(user_id)
+    return reserved
+
+async def mark_user_added(user_id, chat_id):
+    history_cache.add(user_id)
+    await storage.mark(user_id, chat_id, datetime.utcnow().isoformat())
+
+async def unreserve_user_on_failure(user_id):
+    history_cache.discard(user_id)
+    await storage.unreserve(user_id)
+
+async def expire_history(cutoff, reserved_only=False, chunk=MAINTENANCE_CHUNK, pause=MAINTENANCE_PAUSE):
+    total = 0
+    while True:
+        user_ids = await storage.expire(cutoff, chunk, reserved_only)
+        for user_id in user_ids:
+            history_cache.discard(user_id)
+        if user_ids:
+            notify_workers({"op": "forget_users", "user_ids": user_ids})
+        total += len(user_ids)
+        if len(user_ids) < chunk:
+            return total
+        await asyncio.sleep(pause)
+
+async def run_maintenance():
+    now = datetime.utcnow()
+    stale = await expire_history((now - timedelta(seconds=RESERVED_STALE_SECONDS)).isoformat(), reserved_only=True)
+    expired = 0
+    if HISTORY_RETENTION_DAYS > 0:
+        expired = await expire_history((now - timedelta(days=HISTORY_RETENTION_DAYS)).isoformat())
+    vacuumed = await history_writer.submit("vacuum", MAINTENANCE_VACUUM_PAGES)
+    if stale or expired:
+        logger.info("maintenance: swept %d stale reservations, expired %d history rows", stale, expired)
+    return stale, expired, vacuumed
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+        try:
+            await run_maintenance()
+        except Exception:
+            logger.exception("history maintenance failed")
+
+@db_timed
+async def history_for_chat(chat_id, limit=20):
+    async with read_pool.acquire() as db:
+        async with db.execute(
+            "SELECT user_id, added_at FROM history_chat WHERE chat_id = ? ORDER BY added_at DESC LIMIT ?",
+            (chat_id, limit),
+        ) as cur:
+            rows = await cur.fetchall()
+            return rows
+
+@db_timed
+async def history_count_for_chat(chat_id):
+    return await storage.history_count(chat_id)
+
+@db_timed
+async def history_total_count():
+    return await storage.history_count(0)
+
+@db_timed
+async def clear_history_for_chat(chat_id):
+    dropped = await storage.clear_history(chat_id)
+    await history_cache.drop(dropped)
+    for i in range(0, len(dropped), HISTORY_MIGRATION_CHUNK):
+        notify_workers({
+            "op": "drop_users",
+            "user_ids": dropped[i:i + HISTORY_MIGRATION_CHUNK],
+            "last": i + HISTORY_MIGRATION_CHUNK >= len(dropped),
+        })
+
+@db_timed
+async def clear_all_history():
+    await storage.clear_history()
+    history_cache.reset()
+    notify_workers({"op": "reload_cache"})
+
+HISTORY_EXPORT_FIELDS = ("user_id", "chat_id", "added_at")
+
+async def iter_history(chat_id=None, chunk=HISTORY_EXPORT_CHUNK):
+    # keyset pagination: every page is an index range seek from the last
+    # key, so cost and memory stay flat however deep the export goes
+    if chat_id is None:
+        query = (
+            "SELECT user_id, chat_id, added_at FROM history_chat WHERE (user_id, chat_id) > (?, ?) "
+            "ORDER BY user_id, chat_id LIMIT ?"
+        )
+        key = ("", -(1 << 63))
+    else:
+        query = (
+            "SELECT user_id, chat_id, added_at FROM history_chat WHERE chat_id = ? AND (added_at, user_id) > (?, ?) "
+            "ORDER BY added_at, user_id LIMIT ?"
+        )
+        key = ("", "")
+    while True:
+        params = (*key, chunk) if chat_id is None else (chat_id, *key, chunk)
+        async with read_pool.acquire() as db:
+            async with db.execute(query, params) as cur:
+                rows = await cur.fetchall()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+        key = (last[0], last[1]) if chat_id is None else (last[2], last[0])
+        if len(rows) < chunk:
+            return
+
+def _history_format(path):
+    name = str(path).lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+def _encode_history_rows(rows, fmt):
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue().encode()
+    return "".join(
+        json.dumps(dict(zip(HISTORY_EXPORT_FIELDS, row)), separators=(",", ":")) + "\n" for row in rows
+    ).encode()
+
+def _open_history_file(path, mode):
+    if mode == "rb":
+        with open(path, "rb") as f:
+            magic = f.read(2)
+        if magic == b"\x1f\x8b":
+            return gzip.open(path, "rb")
+        return open(path, "rb")
+    if str(path).lower().endswith(".gz"):
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
+
+def _require_sqlite_storage(what):
+    # exports read the local SQLite tables; imports go through any backend
+    if storage.name != "sqlite":
+        raise RuntimeError(f"{what} export works on the sqlite backend, not {storage.name}")
+
+async def export_history(path, chat_id=None):
+    _require_sqlite_storage("history")
+    fmt = _history_format(path)
+    out = await asyncio.to_thread(_open_history_file, path, "wb")
+    total = 0
+    try:
+        if fmt == "csv":
+            await asyncio.to_thread(out.write, (",".join(HISTORY_EXPORT_FIELDS) + "\r\n").encode())
+        async for rows in iter_history(chat_id):
+            await asyncio.to_thread(out.write, _encode_history_rows(rows, fmt))
+            total += len(rows)
+    finally:
+        await asyncio.to_thread(out.close)
+    return total
+
+def _read_history_rows(f):
+    lines = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    first = lines.readline()
+    if not first.strip():
+        return
+    if first.lstrip().startswith("{"):
+        for line in itertools.chain([first], lines):
+            if line.strip():
+                row = json.loads(line)
+                yield str(row["user_id"]), int(row["chat_id"]), row.get("added_at")
+        return
+    reader = csv.reader(itertools.chain([first], lines))
+    header = next(reader)
+    if header != list(HISTORY_EXPORT_FIELDS):
+        reader = itertools.chain([header], reader)
+    for row in reader:
+        if row:
+            yield row[0], int(row[1]), row[2] or None
+
+async def import_history(path, chat_id=None, chunk=HISTORY_EXPORT_CHUNK):
+    f = await asyncio.to_thread(_open_history_file, path, "rb")
+    rows = _read_history_rows(f)
+    now = datetime.utcnow().isoformat()
+    read = added = 0
+    try:
+        while True:
+            batch = await asyncio.to_thread(lambda: list(itertools.islice(rows, chunk)))
+            if not batch:
+                break
+            batch = [
+                (user_id, chat_id if chat_id is not None else row_chat, added_at or now)
+                for user_id, row_chat, added_at in batch
+            ]
+            added += await storage.import_rows(batch)
+            for user_id, _, _ in batch:
+                history_cache.add(user_id)
+            read += len(batch)
+    finally:
+        await asyncio.to_thread(f.close)
+    notify_workers({"op": "reload_cache"})
+    return read, added
+
+async def export_settings(path):
+    # config values and country filters as one JSON document; the migrate:
+    # checkpoints belong to this database and stay behind
+    _require_sqlite_storage("settings")
+    async with read_pool.acquire() as db:
+        async with db.execute("SELECT key, value FROM config WHERE key NOT LIKE 'migrate:%' ORDER BY key") as cur:
+            config = dict(await cur.fetchall())
+        async with db.execute("SELECT chat_id, country FROM exclude ORDER BY chat_id, country") as cur:
+            exclude = {}
+            for chat_id, country in await cur.fetchall():
+                exclude.setdefault(str(chat_id), []).append(country)
+    data = json.dumps({"config": config, "exclude": exclude}, indent=1).encode()
+    await asyncio.to_thread(Path(path).write_bytes, data)
+    return len(config), len(exclude)
+
+async def import_settings(path):
+    data = json.loads(await asyncio.to_thread(Path(path).read_bytes))
+    for key, value in data.get("config", {}).items():
+        await storage.set_config(key, value)
+    for chat_id, countries in data.get("exclude", {}).items():
+        await storage.add_excluded(int(chat_id), countries)
+        invalidate_chat_settings(int(chat_id))
+    return len(data.get("config", {})), len(data.get("exclude", {}))
+
+@db_timed
+async def save_task(task_id, chat_id, token, explore_url, stat_message_id, stats):
+    now = datetime.utcnow().isoformat()
+    async with write_lock:
+        # one saved row per chat and token, whichever session saved it last
+        await sql_db.execute(
+            "DELETE FROM tasks WHERE chat_id = ? AND token = ? AND task_id != ?", (chat_id, token, task_id)
+        )
+        await sql_db.execute(
+            "INSERT OR REPLACE INTO tasks(task_id, chat_id, token, explore_url, stat_message_id, requests, cycles, errors, started_at, updated_at) "
+            "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_id, chat_id, token, explore_url, stat_message_id, stats.requests, stats.cycles, stats.errors, now, now),
+        )
+        await sql_db.commit()
+
+@db_timed
+async def delete_task(task_id):
+    async with write_lock:
+        await sql_db.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        await sql_db.commit()
+
+@db_timed
+async def list_saved_tasks():
+    async with sql_db.execute(
+        "SELECT task_id, chat_id, token, explore_url, stat_message_id, requests, cycles, errors FROM tasks ORDER BY started_at"
+    ) as cur:
+        return await cur.fetchall()
+
+@db_timed
+async def save_task_stats(rows):
+    async with write_lock:
+        await sql_db.executemany(
+            "UPDATE tasks SET requests = ?, cycles = ?, errors = ?, updated_at = ? WHERE task_id = ?",
+            rows,
+        )
+        await sql_db.commit()
+
+@db_timed
+async def record_run(task_id, chat_id, stats, stop_reason):
+    async with write_lock:
+        await sql_db.execute(
+            "INSERT OR REPLACE INTO runs(task_id, chat_id, started_at, ended_at, duration, requests, cycles, errors, "
+            "stop_reason, idle, empty_polls) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                task_id, chat_id, stats.started_at, datetime.utcnow().isoformat(), time.monotonic() - stats.started,
+                stats.requests, stats.cycles, stats.errors, stop_reason, stats.idle, stats.empty_polls,
+            ),
+        )
+        await sql_db.commit()
+
+@db_timed
+async def runs_summary(since):
+    async with read_pool.acquire() as db:
+        async with db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(requests), 0), COALESCE(SUM(duration), 0), COALESCE(SUM(idle), 0), "
+            "COALESCE(SUM(empty_polls), 0) FROM runs WHERE ended_at >= ?",
+            (since,),
+        ) as cur:
+            totals = await cur.fetchone()
+        async with db.execute(
+            "SELECT stop_reason, COUNT(*) FROM runs WHERE ended_at >= ? GROUP BY stop_reason ORDER BY COUNT(*) DESC",
+            (since,),
+        ) as cur:
+            reasons = await cur.fetchall()
+    return totals, reasons
+
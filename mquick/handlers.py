@@ -0,0 +1,391 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from aiogram import F, Router
+from aiogram.filters import Command
+from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+
+from . import matching
+from .db import (
+    add_excluded_countries,
+    clear_all_history,
+    clear_excluded_countries,
+    clear_history_for_chat,
+    export_history,
+    get_config_bool,
+    get_config_value,
+    history_count_for_chat,
+    history_total_count,
+    import_history,
+    invalidate_chat_settings,
+    list_excluded_countries,
+    runs_summary,
+    save_task,
+    set_config_bool,
+    set_config_value,
+)
+from .matching import (
+    StatMessage,
+    TaskStats,
+    launch_matching_task,
+    matching_tasks,
+    stop_keyboard,
+    task_meta,
+    tracer,
+    user_stats,
+    user_tokens,
+)
+from .runtime import loop_monitor
+from .scheduler import db_scheduler, http_scheduler, task_scheduler
+from .settings import ADMIN_IDS, HISTORY_EXPORT_DIR, STATS_RATE_WINDOW
+
+router = Router(name="mquick")
+
+@router.callback_query(F.data.startswith("countries_mode_toggle:"))
+async def _countries_mode_toggle(callback: CallbackQuery):
+    parts = callback.data.split(":", 1)
+    if len(parts) < 2:
+        await callback.answer("Invalid data", show_alert=False)
+        return
+    try:
+        chat_id = int(parts[1])
+    except:
+        await callback.answer("Invalid chat id", show_alert=False)
+        return
+    current = (await get_config_value(f"countries_mode:{chat_id}")) or "exclude"
+    new = "include" if current == "exclude" else "exclude"
+    await set_config_value(f"countries_mode:{chat_id}", new)
+    invalidate_chat_settings(chat_id)
+    enabled = await get_config_bool(f"countries_enabled:{chat_id}", default=True)
+    countries = await list_excluded_countries(chat_id)
+    state = "ON" if enabled else "OFF"
+    text = f"Countries ({new.upper()}) ({state}):\n" + (", ".join(countries) if countries else "No countries set.")
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{new.upper()}", callback_data=f"countries_mode_toggle:{chat_id}"),
+         InlineKeyboardButton(text=f"{'ON' if enabled else 'OFF'}", callback_data=f"countries_enabled_toggle:{chat_id}")],
+        [InlineKeyboardButton(text="Clear", callback_data=f"countries_clear:{chat_id}")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await callback.answer(f"Mode set to {new}", show_alert=False)
+
+@router.callback_query(F.data.startswith("countries_enabled_toggle:"))
+async def _countries_enabled_toggle(callback: CallbackQuery):
+    parts = callback.data.split(":", 1)
+    if len(parts) < 2:
+        await callback.answer("Invalid data", show_alert=False)
+        return
+    try:
+        chat_id = int(parts[1])
+    except:
+        await callback.answer("Invalid chat id", show_alert=False)
+        return
+    current = await get_config_bool(f"countries_enabled:{chat_id}", default=True)
+    new = not current
+    await set_config_bool(f"countries_enabled:{chat_id}", new)
+    invalidate_chat_settings(chat_id)
+    mode = (await get_config_value(f"countries_mode:{chat_id}")) or "exclude"
+    countries = await list_excluded_countries(chat_id)
+    state = "ON" if new else "OFF"
+    text = f"Countries ({mode.upper()}) ({state}):\n" + (", ".join(countries) if countries else "No countries set.")
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"Mode: {mode.upper()}", callback_data=f"countries_mode_toggle:{chat_id}"),
+         InlineKeyboardButton(text=f"{'ON' if new else 'OFF'}", callback_data=f"countries_enabled_toggle:{chat_id}")],
+        [InlineKeyboardButton(text="Clear", callback_data=f"countries_clear:{chat_id}")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await callback.answer(f"Filter enabled set to {'ON' if new else 'OFF'}", show_alert=False)
+
+@router.callback_query(F.data.startswith("countries_clear:"))
+async def _countries_clear(callback: CallbackQuery):
+    parts = callback.data.split(":", 1)
+    if len(parts) < 2:
+        await callback.answer("Invalid data", show_alert=False)
+        return
+    try:
+        chat_id = int(parts[1])
+    except:
+        await callback.answer("Invalid chat id", show_alert=False)
+        return
+    await clear_excluded_countries(chat_id)
+    await set_config_value(f"countries_mode:{chat_id}", "exclude")
+    await set_config_bool(f"countries_enabled:{chat_id}", True)
+    invalidate_chat_settings(chat_id)
+    text = "Countries (EXCLUDE) (ON):\nNo countries set."
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Mode: EXCLUDE", callback_data=f"countries_mode_toggle:{chat_id}"),
+         InlineKeyboardButton(text="ON", callback_data=f"countries_enabled_toggle:{chat_id}")],
+        [InlineKeyboardButton(text="Clear", callback_data=f"countries_clear:{chat_id}")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await callback.answer("Cleared countries list.", show_alert=False)
+
+@router.callback_query(F.data.startswith("hist_toggle:"))
+async def _hist_toggle(callback: CallbackQuery):
+    parts = callback.data.split(":", 1)
+    if len(parts) < 2:
+        await callback.answer("Invalid data", show_alert=False)
+        return
+    try:
+        chat_id = int(parts[1])
+    except:
+        await callback.answer("Invalid chat id", show_alert=False)
+        return
+    current = await get_config_bool(f"history_enabled:{chat_id}", default=True)
+    new = not current
+    await set_config_bool(f"history_enabled:{chat_id}", new)
+    invalidate_chat_settings(chat_id)
+    total = await history_total_count()
+    count = await history_count_for_chat(chat_id)
+    state = "ON" if new else "OFF"
+    text = f"History ({state}):\nTotal saved ids: {total}\nYour saved ids: {count}"
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{'ON' if new else 'OFF'}", callback_data=f"hist_toggle:{chat_id}"),
+         InlineKeyboardButton(text="Clear", callback_data=f"hist_clear:{chat_id}")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await callback.answer(f"History dedupe set to {state}", show_alert=False)
+
+@router.callback_query(F.data.startswith("hist_clear:"))
+async def _hist_clear(callback: CallbackQuery):
+    parts = callback.data.split(":", 1)
+    if len(parts) < 2:
+        await callback.answer("Invalid data", show_alert=False)
+        return
+    try:
+        chat_id = int(parts[1])
+    except:
+        await callback.answer("Invalid chat id", show_alert=False)
+        return
+    await clear_all_history()
+    await set_config_bool(f"history_enabled:{chat_id}", True)
+    invalidate_chat_settings(chat_id)
+    total = await history_total_count()
+    count = await history_count_for_chat(chat_id)
+    text = f"History (ON):\nTotal saved ids: {total}\nYour saved ids: {count}"
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="ON", callback_data=f"hist_toggle:{chat_id}"),
+         InlineKeyboardButton(text="Clear", callback_data=f"hist_clear:{chat_id}")]
+    ])
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except:
+        pass
+    await callback.answer("Cleared all history.", show_alert=False)
+
+@router.message(F.text.startswith("https://api.meeff.com/user/explore"))
+async def set_explore_url_direct(message):
+    url = message.text.strip()
+    await set_config_value("explore_url", url)
+    await message.answer("Explore URL saved.")
+
+@router.message(Command("start"))
+async def start(message):
+    await message.answer("Send Meeff Token.")
+
+@router.message(Command("countries"))
+async def countries_cmd(message):
+    chat_id = message.chat.id
+    parts = message.text.split(maxsplit=1)
+    args = parts[1].strip() if len(parts) > 1 else ""
+    if not args:
+        countries = await list_excluded_countries(chat_id)
+        mode = (await get_config_value(f"countries_mode:{chat_id}")) or "exclude"
+        enabled = await get_config_bool(f"countries_enabled:{chat_id}", default=True)
+        state = "ON" if enabled else "OFF"
+        display = ", ".join(countries) if countries else "No countries set."
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"Mode: {mode.upper()}", callback_data=f"countries_mode_toggle:{chat_id}"),
+             InlineKeyboardButton(text=f"{'ON' if enabled else 'OFF'}", callback_data=f"countries_enabled_toggle:{chat_id}")],
+            [InlineKeyboardButton(text="Clear", callback_data=f"countries_clear:{chat_id}")]
+        ])
+        await message.answer(f"Countries ({mode.upper()}) ({state}):\n{display}", reply_markup=kb)
+        return
+    codes = [p.upper() for p in args.split() if p.strip()]
+    if not codes:
+        await message.answer("No country codes provided.")
+        return
+    await add_excluded_countries(chat_id, codes)
+    await message.answer("Added to countries list: " + ", ".join(codes))
+
+@router.message(Command("history"))
+async def history_cmd(message):
+    chat_id = message.chat.id
+    parts = (message.text or message.caption or "").split(maxsplit=1)
+    args = parts[1].strip() if len(parts) > 1 else ""
+    if not args:
+        total = await history_total_count()
+        count = await history_count_for_chat(chat_id)
+        enabled = await get_config_bool(f"history_enabled:{chat_id}", default=True)
+        state = "ON" if enabled else "OFF"
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"{state}", callback_data=f"hist_toggle:{chat_id}"),
+             InlineKeyboardButton(text="Clear", callback_data=f"hist_clear:{chat_id}")]
+        ])
+        await message.answer(f"History ({state}):\nTotal saved ids: {total}\nYour saved ids: {count}", reply_markup=kb)
+        return
+    if args.lower() == "clear":
+        try:
+            await clear_history_for_chat(chat_id)
+            await message.answer("History cleared for this chat.")
+        except Exception as e:
+            await message.answer(f"Error clearing history: {e}")
+        return
+    if args.lower().startswith("export"):
+        fmt = "csv" if args.lower().endswith("csv") else "ndjson"
+        path = Path(HISTORY_EXPORT_DIR) / f"history-{chat_id}-{uuid.uuid4().hex[:8]}.{fmt}.gz"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            total = await export_history(path, chat_id)
+            await message.answer_document(FSInputFile(path, filename=f"history-{chat_id}.{fmt}.gz"), caption=f"{total} ids")
+        except Exception as e:
+            await message.answer(f"Error exporting history: {e}")
+        finally:
+            path.unlink(missing_ok=True)
+        return
+    if args.lower() == "import":
+        document = message.document or (message.reply_to_message and message.reply_to_message.document)
+        if document is None:
+            await message.answer("Send an export file with the caption /history import, or reply to one with it.")
+            return
+        path = Path(HISTORY_EXPORT_DIR) / f"import-{chat_id}-{uuid.uuid4().hex[:8]}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            await message.bot.download(document, destination=path)
+            read, added = await import_history(path, chat_id)
+            await message.answer(f"Imported {added} new ids ({read} rows read).")
+        except Exception as e:
+            await message.answer(f"Error importing history: {e}")
+        finally:
+            path.unlink(missing_ok=True)
+        return
+
+def is_admin(message):
+    return message.from_user is not None and message.from_user.id in ADMIN_IDS
+
+@router.message(Command("profile"))
+async def profile_cmd(message):
+    if not is_admin(message):
+        return
+    if tracer.sample_rate <= 0:
+        await message.answer("Tracing is off. Set TRACE_SAMPLE_RATE to sample cycles.")
+        return
+    slowest = tracer.slowest(10)
+    if not slowest:
+        await message.answer(f"No sampled cycles yet (rate {tracer.sample_rate:g}).")
+        return
+    lines = [f"Slowest of {len(tracer.recent)} sampled cycles:"]
+    for t in slowest:
+        top = sorted(t["phases"].items(), key=lambda kv: -kv[1])[:4]
+        phases = ", ".join(f"{name} {sec * 1000:.0f}ms" for name, sec in top)
+        when = datetime.utcfromtimestamp(t["ts"]).strftime("%H:%M:%S")
+        lines.append(f"{when} chat {t['chat_id']} {t['duration'] * 1000:.0f}ms users {t.get('users', 0)}: {phases}")
+    await message.answer("\n".join(lines), parse_mode=None)
+
+@router.message(Command("status"))
+async def status_cmd(message):
+    if not is_admin(message):
+        return
+    now = time.monotonic()
+    running = []
+    for task_id, meta in list(task_meta.items()):
+        stats = user_stats.get(meta["key"])
+        if stats is None:
+            continue
+        requests_rate, cycles_rate = stats.rates(now)
+        running.append((task_id, int(meta["key"].split(":", 1)[0]), stats, requests_rate, cycles_rate))
+    per_chat = {}
+    for _, chat_id, stats, requests_rate, _ in running:
+        tasks, rate = per_chat.get(chat_id, (0, 0.0))
+        per_chat[chat_id] = (tasks + 1, rate + requests_rate)
+    lines = [
+        f"Running tasks: {len(running)} in {len(per_chat)} chats",
+        f"Requests: {sum(r[2].requests for r in running)}  Cycles: {sum(r[2].cycles for r in running)}  "
+        f"Errors: {sum(r[2].errors for r in running)}",
+        f"Rate: {sum(r[3] for r in running):.1f} req/min over {STATS_RATE_WINDOW:g}s",
+        f"Scheduler: {task_scheduler.total} running, {task_scheduler.depth()} queued, "
+        f"avg wait {task_scheduler.average_wait():.0f}s",
+        f"Slots in use: http {http_scheduler.total}/{http_scheduler.limit}, db {db_scheduler.total}/{db_scheduler.limit}",
+    ]
+    if loop_monitor.samples:
+        lag = loop_monitor.summary()
+        lines.append(
+            f"Loop ({lag['loop']}): lag p99 {lag['lag_p99_ms']:.0f}ms, max {lag['lag_max_ms']:.0f}ms, "
+            f"{lag['stalls']} stalls"
+        )
+    if per_chat:
+        lines.append("\nTop chats (req/min):")
+        for chat_id, (tasks, rate) in sorted(per_chat.items(), key=lambda kv: -kv[1][1])[:10]:
+            lines.append(f"{chat_id}: {rate:.1f} ({tasks} tasks)")
+    if running:
+        lines.append("\nSlowest tasks (req/min):")
+        for task_id, chat_id, stats, requests_rate, cycles_rate in sorted(running, key=lambda r: r[3])[:5]:
+            lines.append(f"{task_id[:8]} chat {chat_id}: {requests_rate:.1f} req/min, {cycles_rate:.1f} cycles/min")
+    since = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    (runs, run_requests, run_seconds, run_idle, run_empty), reasons = await runs_summary(since)
+    lines.append(f"\nFinished runs (24h): {runs}, {run_requests} requests, {run_seconds / 3600:.1f} task-hours")
+    if run_seconds:
+        lines.append(
+            f"Idle: {run_idle / 3600:.1f} task-hours, {run_empty / (run_seconds / 3600):.1f} empty polls per task-hour"
+        )
+    if reasons:
+        lines.append(", ".join(f"{reason or 'UNKNOWN'} {count}" for reason, count in reasons))
+    await message.answer("\n".join(lines), parse_mode=None)
+
+@router.message(F.text)
+async def receive_token(message):
+    if not message.text:
+        return
+    if message.text.startswith("/"):
+        return
+    if message.text.startswith("https://api.meeff.com/user/explore"):
+        return
+    chat_id = message.chat.id
+    token = message.text.strip()
+    lst = user_tokens.get(chat_id, [])
+    if token not in lst:
+        lst.append(token)
+        user_tokens[chat_id] = lst
+    explore_url = await get_config_value("explore_url")
+    if not explore_url:
+        return await message.answer("Send explore URL.")
+    key = f"{chat_id}:{token}"
+    if key in matching_tasks:
+        return
+    task_id = uuid.uuid4().hex
+    sent = await message.bot.send_message(
+        chat_id,
+        "Live Stats:\nRequests: 0\nCycles: 0\nErrors: 0",
+        reply_markup=InlineKeyboardMarkup.model_validate(stop_keyboard(task_id)),
+    )
+    stats = TaskStats()
+    await save_task(task_id, chat_id, token, explore_url, sent.message_id, stats)
+    launch_matching_task(chat_id, token, explore_url, StatMessage(chat_id, sent.message_id), task_id, stats)
+
+@router.callback_query(F.data.startswith("stop_task:"))
+async def _stop_task(callback: CallbackQuery):
+    task_id = callback.data.split(":", 1)[1]
+    meta = task_meta.get(task_id)
+    if not meta:
+        await callback.answer("Already stopped.", show_alert=False)
+        return
+    meta["running"] = False
+    key = meta.get("key")
+    t = matching_tasks.pop(key, None)
+    if t:
+        t.cancel()
+    await matching.stats_renderer.render(meta["stat_msg"], "Stopping...", force=True)
+    await callback.answer("Stopping task.", show_alert=False)
@@ -0,0 +1,783 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from types import SimpleNamespace
+from typing import NamedTuple, Optional
+
+import aiohttp
+
+from .db import (
+    ChatSettings,
+    delete_task,
+    get_chat_settings,
+    history_cache,
+    history_writer,
+    list_saved_tasks,
+    mark_user_added,
+    record_run,
+    reserve_user,
+    save_task_stats,
+    unreserve_user_on_failure,
+)
+from .metrics import metrics
+from .scheduler import db_scheduler, http_scheduler, schedulers, task_scheduler
+from .settings import (
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_TIMEOUT,
+    IDLE_BACKOFF,
+    IDLE_BACKOFF_BASE,
+    IDLE_BACKOFF_FACTOR,
+    IDLE_BACKOFF_MAX,
+    IDLE_PARK_AFTER,
+    IDLE_STOP_AFTER,
+    JSON_BACKEND,
+    SCHEDULER_QUEUE_REFRESH,
+    STATS_CHAT_INTERVAL,
+    STATS_EDIT_BURST,
+    STATS_EDIT_RATE,
+    STATS_MESSAGE_INTERVAL,
+    STATS_RATE_WINDOW,
+    TASK_CHECKPOINT_INTERVAL,
+    TASK_RESUME_STAGGER,
+    TRACE_FILE,
+    TRACE_RECENT,
+    TRACE_SAMPLE_RATE,
+    TRACE_SINKS,
+)
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("mquick")
+
+HEADERS_TEMPLATE = {
+    "User-Agent": "okhttp/5.1.0 (Linux; Android 13; Pixel 6 Build/TQ3A.230901.001)",
+    "Accept-Encoding": "gzip",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+    "Host": "api.meeff.com",
+}
+
+ANSWER_URL = os.environ.get(
+    "ANSWER_URL", "https://api.meeff.com/user/undoableAnswer/v5/?userId={user_id}&isOkay=1"
+)
+
+user_tokens = {}
+matching_tasks = {}
+user_stats = {}
+task_meta = {}
+shutting_down = False
+worker_pool = None
+ipc = None
+bot = None
+
+class TaskStats:
+    __slots__ = ("requests", "cycles", "errors", "started", "started_at", "samples", "waited", "idle", "empty_polls")
+
+    def __init__(self, requests=0, cycles=0, errors=0, idle=0.0, empty_polls=0):
+        self.requests = requests
+        self.cycles = cycles
+        self.errors = errors
+        self.idle = idle
+        self.empty_polls = empty_polls
+        self.started = time.monotonic()
+        self.started_at = datetime.utcnow().isoformat()
+        self.samples = deque()
+        self.waited = 0.0
+        self.sample()
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            data.get("requests", 0), data.get("cycles", 0), data.get("errors", 0),
+            data.get("idle", 0.0), data.get("empty_polls", 0),
+        )
+
+    def as_dict(self):
+        return {
+            "requests": self.requests, "cycles": self.cycles, "errors": self.errors,
+            "idle": self.idle, "empty_polls": self.empty_polls,
+        }
+
+    def update(self, data):
+        self.requests = data.get("requests", self.requests)
+        self.cycles = data.get("cycles", self.cycles)
+        self.errors = data.get("errors", self.errors)
+        self.idle = data.get("idle", self.idle)
+        self.empty_polls = data.get("empty_polls", self.empty_polls)
+        self.sample()
+
+    def sample(self, now=None):
+        now = now if now is not None else time.monotonic()
+        self.samples.append((now, self.requests, self.cycles))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= STATS_RATE_WINDOW:
+            self.samples.popleft()
+
+    def rates(self, now=None):
+        now = now if now is not None else time.monotonic()
+        t0, requests0, cycles0 = self.samples[0]
+        elapsed = now - t0
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (self.requests - requests0) / elapsed * 60, (self.cycles - cycles0) / elapsed * 60
+
+    def text(self, title="Live Stats:", stop_reason=None):
+        text = f"{title}\nRequests: {self.requests}\nCycles: {self.cycles}\nErrors: {self.errors}"
+        if self.idle >= 1:
+            text += f"\nIdle: {self.idle:.0f}s ({self.empty_polls} empty pages)"
+        if self.waited >= 1:
+            text += f"\nQueued for: {self.waited:.0f}s"
+        depth = task_scheduler.depth()
+        if depth:
+            text += f"\nQueue: {depth} waiting, avg wait {task_scheduler.average_wait():.0f}s"
+        if stop_reason:
+            text += f"\n\n⚠️ {stop_reason}"
+        return text
+
+async def checkpoint_tasks():
+    now = datetime.utcnow().isoformat()
+    rows = []
+    for task_id, meta in list(task_meta.items()):
+        stats = user_stats.get(meta["key"])
+        if stats:
+            rows.append((stats.requests, stats.cycles, stats.errors, now, task_id))
+    if rows:
+        await save_task_stats(rows)
+
+async def task_checkpoint_loop():
+    while True:
+        await asyncio.sleep(TASK_CHECKPOINT_INTERVAL)
+        try:
+            await checkpoint_tasks()
+        except Exception:
+            logger.exception("task checkpoint failed")
+
+class StatMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = message_id
+
+    async def edit_text(self, text, reply_markup=None):
+        return await bot.edit_message_text(
+            text, chat_id=self.chat.id, message_id=self.message_id, reply_markup=reply_markup
+        )
+
+class StatsRenderer:
+    def __init__(
+        self,
+        message_interval=STATS_MESSAGE_INTERVAL,
+        chat_interval=STATS_CHAT_INTERVAL,
+        rate=STATS_EDIT_RATE,
+        burst=STATS_EDIT_BURST,
+    ):
+        self.message_interval = message_interval
+        self.chat_interval = chat_interval
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.last_text = {}
+        self.last_message_edit = {}
+        self.last_chat_edit = {}
+        self.message_dropped = {}
+        self.edits = 0
+        self.unchanged = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _take_token(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def _drop(self, key):
+        self.dropped += 1
+        self.message_dropped[key] = self.message_dropped.get(key, 0) + 1
+        return False
+
+    async def render(self, msg, text, reply_markup=None, force=False):
+        chat_id = msg.chat.id
+        key = (chat_id, msg.message_id)
+        if self.last_text.get(key) == (text, reply_markup):
+            self.unchanged += 1
+            return False
+        now = time.monotonic()
+        if not force:
+            if now < self.paused_until:
+                return self._drop(key)
+            if now - self.last_message_edit.get(key, 0.0) < self.message_interval:
+                return self._drop(key)
+            if now - self.last_chat_edit.get(chat_id, 0.0) < self.chat_interval:
+                return self._drop(key)
+            if not self._take_token(now):
+                return self._drop(key)
+        self.last_message_edit[key] = now
+        self.last_chat_edit[chat_id] = now
+        from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+        from aiogram.types import InlineKeyboardMarkup
+        markup = InlineKeyboardMarkup.model_validate(reply_markup) if reply_markup else None
+        try:
+            await msg.edit_text(text, reply_markup=markup)
+        except TelegramRetryAfter as e:
+            self.failed += 1
+            self.paused_until = time.monotonic() + e.retry_after
+            logger.warning("stats edit flood limited, pausing edits for %ss", e.retry_after)
+            return False
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                self.last_text[key] = (text, reply_markup)
+                self.unchanged += 1
+                return False
+            self.failed += 1
+            logger.warning("stats edit failed for %s: %s", key, e)
+            return False
+        except Exception as e:
+            self.failed += 1
+            logger.warning("stats edit failed for %s: %s", key, e)
+            return False
+        self.edits += 1
+        self.last_text[key] = (text, reply_markup)
+        return True
+
+    def forget(self, msg):
+        key = (msg.chat.id, msg.message_id)
+        self.last_text.pop(key, None)
+        self.last_message_edit.pop(key, None)
+        dropped = self.message_dropped.pop(key, 0)
+        if dropped:
+            logger.info("stats message %s: %d edits dropped by rate limiter", key, dropped)
+        return dropped
+
+stats_renderer = StatsRenderer()
+
+@metrics.collector
+def collect_runtime_metrics():
+    yield "mquick_matching_tasks", {}, len(matching_tasks)
+    yield "mquick_task_meta", {}, len(task_meta)
+    yield "mquick_history_writer_queue", {}, history_writer.queue.qsize()
+    yield "mquick_history_writer_flushes_total", {}, history_writer.flushes
+    yield "mquick_history_writer_ops_total", {}, history_writer.ops
+    yield "mquick_history_cache_lookups_total", {"result": "hit"}, history_cache.hits
+    yield "mquick_history_cache_lookups_total", {"result": "miss"}, history_cache.misses
+    yield "mquick_stats_edits_total", {"outcome": "sent"}, stats_renderer.edits
+    yield "mquick_stats_edits_total", {"outcome": "unchanged"}, stats_renderer.unchanged
+    yield "mquick_stats_edits_total", {"outcome": "dropped"}, stats_renderer.dropped
+    yield "mquick_stats_edits_total", {"outcome": "failed"}, stats_renderer.failed
+    for scheduler in schedulers:
+        yield from scheduler.collect()
+    for task_id, meta in list(task_meta.items()):
+        stats = user_stats.get(meta.get("key"))
+        if not stats:
+            continue
+        labels = {"task": task_id, "chat": meta.get("key", "").split(":", 1)[0]}
+        yield "mquick_task_requests_total", labels, stats.requests
+        yield "mquick_task_cycles_total", labels, stats.cycles
+        yield "mquick_task_errors_total", labels, stats.errors
+
+class HttpSessionManager:
+    def __init__(
+        self,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        timeout=HTTP_TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.session = None
+
+    def get(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=False,
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+http_sessions = HttpSessionManager()
+
+if msgspec is not None:
+    class ExploreUser(msgspec.Struct):
+        user_id: Optional[str] = msgspec.field(default=None, name="_id")
+        nationality_code: Optional[str] = msgspec.field(default=None, name="nationalityCode")
+        locale: Optional[str] = None
+
+    class ExplorePage(msgspec.Struct):
+        users: list[ExploreUser] = []
+
+    _explore_decoder = msgspec.json.Decoder(ExplorePage)
+else:
+    class ExploreUser(NamedTuple):
+        user_id: Optional[str] = None
+        nationality_code: Optional[str] = None
+        locale: Optional[str] = None
+
+    _explore_decoder = None
+
+def _json_loads():
+    if JSON_BACKEND in ("auto", "orjson") and orjson is not None:
+        return orjson.loads
+    if JSON_BACKEND in ("auto", "msgspec") and msgspec is not None:
+        return msgspec.json.decode
+    return json.loads
+
+json_loads = _json_loads()
+
+def _project_users(data):
+    users = data.get("users") if isinstance(data, dict) else None
+    if not users:
+        return []
+    return [
+        ExploreUser(u.get("_id"), u.get("nationalityCode"), u.get("locale"))
+        for u in users
+        if isinstance(u, dict)
+    ]
+
+def decode_explore(body):
+    if _explore_decoder is not None and JSON_BACKEND in ("auto", "msgspec"):
+        try:
+            return _explore_decoder.decode(body).users
+        except msgspec.ValidationError:
+            pass
+        except msgspec.DecodeError:
+            return None
+    try:
+        return _project_users(json_loads(body))
+    except Exception:
+        return None
+
+async def fetch_users(session, explore_url, headers=None):
+    start = time.perf_counter()
+    status = "error"
+    try:
+        async with session.get(explore_url, headers=headers) as res:
+            status = res.status
+            body = await res.read()
+            if status != 200:
+                return status, body, None
+            return status, body, decode_explore(body)
+    finally:
+        metrics.observe("mquick_http_request_seconds", time.perf_counter() - start, endpoint="explore", status=str(status))
+
+class CycleTrace:
+    __slots__ = ("chat_id", "task_id", "wall", "started", "spans", "attrs")
+
+    def __init__(self, chat_id, task_id):
+        self.chat_id = chat_id
+        self.task_id = task_id
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attrs = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, start, time.perf_counter()))
+
+    def add(self, name, start, end=None):
+        self.spans.append((name, start, end if end is not None else time.perf_counter()))
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def summary(self):
+        phases = {}
+        for name, start, end in self.spans:
+            phases[name] = phases.get(name, 0.0) + end - start
+        return {
+            "ts": self.wall,
+            "chat_id": self.chat_id,
+            "task_id": self.task_id,
+            "duration": time.perf_counter() - self.started,
+            "phases": phases,
+            "spans": [(name, start - self.started, end - start) for name, start, end in self.spans],
+            **self.attrs,
+        }
+
+class NullTrace:
+    def span(self, name):
+        return nullcontext()
+
+    def add(self, name, start, end=None):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+NULL_TRACE = NullTrace()
+
+def log_trace_sink(summary):
+    phases = ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in sorted(summary["phases"].items(), key=lambda kv: -kv[1]))
+    logger.info("cycle %s chat=%s %.1fms: %s", summary["task_id"], summary["chat_id"], summary["duration"] * 1000, phases)
+
+def jsonl_trace_sink(summary):
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(summary) + "\n")
+
+def otel_trace_sink(summary):
+    from opentelemetry import trace as otel_trace
+    tracer = otel_trace.get_tracer("mquick")
+    base = int(summary["ts"] * 1e9)
+    root = tracer.start_span("matching_cycle", start_time=base)
+    root.set_attribute("chat_id", summary["chat_id"])
+    root.set_attribute("task_id", summary["task_id"])
+    ctx = otel_trace.set_span_in_context(root)
+    for name, offset, duration in summary["spans"]:
+        span = tracer.start_span(name, context=ctx, start_time=base + int(offset * 1e9))
+        span.end(end_time=base + int((offset + duration) * 1e9))
+    root.end(end_time=base + int(summary["duration"] * 1e9))
+
+TRACE_SINK_FACTORIES = {
+    "log": lambda: log_trace_sink,
+    "jsonl": lambda: jsonl_trace_sink,
+    "otel": lambda: otel_trace_sink if importlib.util.find_spec("opentelemetry") else None,
+}
+
+class Tracer:
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, sinks=TRACE_SINKS, recent=TRACE_RECENT):
+        self.sample_rate = sample_rate
+        self.sinks = []
+        for name in sinks:
+            factory = TRACE_SINK_FACTORIES.get(name)
+            sink = factory() if factory else None
+            if sink is None:
+                logger.warning("trace sink %r is not available", name)
+            else:
+                self.sinks.append(sink)
+        self.recent = deque(maxlen=recent)
+
+    def start(self, chat_id, task_id):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return NULL_TRACE
+        return CycleTrace(chat_id, task_id)
+
+    def finish(self, trace):
+        if trace is NULL_TRACE:
+            return
+        self.record(trace.summary())
+
+    def record(self, summary):
+        if ipc is not None:
+            ipc.send({"op": "trace", "trace": summary})
+            return
+        self.recent.append(summary)
+        for sink in self.sinks:
+            try:
+                sink(summary)
+            except Exception:
+                logger.exception("trace sink failed")
+
+    def slowest(self, n=10):
+        return sorted(self.recent, key=lambda t: t["duration"], reverse=True)[:n]
+
+tracer = Tracer()
+
+class IdleBackoff:
+    # delay before polling an empty explore feed again: fixed, exponential,
+    # or exponential with jitter so idle tasks don't poll in lockstep; grows
+    # up to the cap while the feed stays empty and resets on a page with users
+    def __init__(self, policy=IDLE_BACKOFF, base=IDLE_BACKOFF_BASE, factor=IDLE_BACKOFF_FACTOR, cap=IDLE_BACKOFF_MAX):
+        self.policy = policy
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.delay = 0.0
+
+    def next_delay(self):
+        if self.policy == "fixed" or not self.delay:
+            self.delay = self.base
+        else:
+            self.delay = min(self.cap, self.delay * self.factor)
+        if self.policy == "jittered":
+            return random.uniform(self.delay / 2, self.delay)
+        return self.delay
+
+    def reset(self):
+        self.delay = 0.0
+
+async def start_matching(chat_id, token, explore_url, stat_msg, task_id, keyboard, stats=None):
+    key = f"{chat_id}:{token}"
+    headers = HEADERS_TEMPLATE.copy()
+    headers["meeff-access-token"] = token
+    stats = stats or TaskStats()
+    user_stats[key] = stats
+    backoff = IdleBackoff()
+    idle_since = None
+    stop_reason = None
+    acquired = False
+
+    async def show_queue(waiter):
+        text = (
+            f"Queued: #{task_scheduler.position(waiter)} in this chat, "
+            f"{task_scheduler.depth()} waiting overall\n"
+            f"Waiting: {time.monotonic() - waiter.queued_at:.0f}s"
+        )
+        await stats_renderer.render(stat_msg, text, reply_markup=keyboard)
+
+    try:
+        stats.waited = await task_scheduler.acquire(chat_id, show_queue, SCHEDULER_QUEUE_REFRESH)
+        acquired = True
+        session = http_sessions.get()
+
+        async def send_answer(user_id):
+            nonlocal stop_reason
+            start = time.perf_counter()
+            status = "error"
+            try:
+                async with session.get(ANSWER_URL.format(user_id=user_id), headers=headers) as res:
+                    status = res.status
+                    text = await res.text()
+                    metrics.observe(
+                        "mquick_http_request_seconds", time.perf_counter() - start, endpoint="answer", status=str(status)
+                    )
+                    if res.status == 429 or "LikeExceeded" in text:
+                        stop_reason = "LIMIT EXCEEDED"
+                        await unreserve_user_on_failure(user_id)
+                        return False
+                    if res.status == 401 or "AuthRequired" in text:
+                        stop_reason = "TOKEN EXPIRED"
+                        await unreserve_user_on_failure(user_id)
+                        return False
+                    if res.status == 200:
+                        await mark_user_added(user_id, chat_id)
+                    else:
+                        await unreserve_user_on_failure(user_id)
+                    return True
+            except Exception:
+                stats.errors += 1
+                if status == "error":
+                    metrics.observe(
+                        "mquick_http_request_seconds", time.perf_counter() - start, endpoint="answer", status=status
+                    )
+                try:
+                    await unreserve_user_on_failure(user_id)
+                except:
+                    pass
+                return True
+
+        async def answer_user(user_id):
+            async with http_scheduler.slot(chat_id):
+                return await send_answer(user_id)
+
+        while task_meta.get(task_id) and task_meta[task_id].get("running", True):
+            trace = tracer.start(chat_id, task_id)
+            try:
+                try:
+                    with trace.span("settings"):
+                        settings = await get_chat_settings(chat_id)
+                except Exception:
+                    settings = ChatSettings()
+                with trace.span("fetch_users"):
+                    async with http_scheduler.slot(chat_id):
+                        status, raw_body, users = await fetch_users(session, explore_url, headers)
+                trace.set(status=status, users=len(users) if users else 0)
+                if status == 401 or b"AuthRequired" in raw_body:
+                    stop_reason = "TOKEN EXPIRED"
+                    break
+                if not users:
+                    now = time.monotonic()
+                    idle_since = idle_since or now
+                    stats.empty_polls += 1
+                    if IDLE_STOP_AFTER > 0 and now - idle_since >= IDLE_STOP_AFTER:
+                        stop_reason = "NO USERS FOUND"
+                        break
+                    delay = backoff.next_delay()
+                    await stats_renderer.render(stat_msg, stats.text(), reply_markup=keyboard)
+                    # a long wait while others are queued hands the task slot over meanwhile
+                    park = delay >= IDLE_PARK_AFTER and task_scheduler.depth() > 0
+                    if park:
+                        task_scheduler.release(chat_id)
+                        acquired = False
+                    with trace.span("idle_sleep"):
+                        await asyncio.sleep(delay)
+                    stats.idle += time.monotonic() - now
+                    if park:
+                        stats.waited += await task_scheduler.acquire(chat_id, show_queue, SCHEDULER_QUEUE_REFRESH)
+                        acquired = True
+                    continue
+                backoff.reset()
+                idle_since = None
+                tasks = []
+                results = []
+                loop_started = time.perf_counter()
+                for user_id in settings.country_filter.select(users):
+                    reserved = True
+                    if settings.history_enabled:
+                        with trace.span("reserve_user"):
+                            async with db_scheduler.slot(chat_id):
+                                reserved = await reserve_user(user_id, chat_id)
+                    if not reserved:
+                        continue
+                    task = asyncio.create_task(answer_user(user_id))
+                    tasks.append(task)
+                    stats.requests += 1
+                    with trace.span("pace_sleep"):
+                        await asyncio.sleep(random.uniform(0.05, 0.2))
+                    if len(tasks) >= 10:
+                        with trace.span("answer_gather"):
+                            batch_results = await asyncio.gather(*tasks)
+                        results.extend(batch_results)
+                        tasks.clear()
+                        if False in batch_results:
+                            break
+                trace.add("user_loop", loop_started)
+                if tasks:
+                    with trace.span("answer_gather"):
+                        batch_results = await asyncio.gather(*tasks)
+                    results.extend(batch_results)
+                if False in results:
+                    break
+                stats.cycles += 1
+                stats.sample()
+                final_text = stats.text(stop_reason=stop_reason)
+                with trace.span("render"):
+                    await stats_renderer.render(stat_msg, final_text, reply_markup=keyboard)
+                with trace.span("cycle_sleep"):
+                    await asyncio.sleep(random.uniform(1, 2))
+            finally:
+                tracer.finish(trace)
+    except asyncio.CancelledError:
+        try:
+            await history_writer.flush()
+        except Exception:
+            logger.exception("history flush failed while stopping task %s", task_id)
+        if shutting_down:
+            raise
+        await stats_renderer.render(stat_msg, stats.text(title="Stopped.\n"), force=True)
+        stats_renderer.forget(stat_msg)
+        metrics.inc("mquick_task_stops_total", reason="CANCELLED")
+        await finish_task(chat_id, token, task_id, "STOPPED")
+        raise
+    except Exception as e:
+        stop_reason = stop_reason or "ERROR"
+        await stats_renderer.render(stat_msg, f"Error: {e}", reply_markup=keyboard, force=True)
+    finally:
+        if acquired:
+            task_scheduler.release(chat_id)
+    metrics.inc("mquick_task_stops_total", reason=stop_reason or "STOPPED")
+    if stop_reason and stop_reason != "ERROR":
+        await stats_renderer.render(stat_msg, stats.text(stop_reason=stop_reason), force=True)
+    stats_renderer.forget(stat_msg)
+    await finish_task(chat_id, token, task_id, stop_reason or "STOPPED")
+
+async def finish_task(chat_id, token, task_id, stop_reason=None):
+    key = f"{chat_id}:{token}"
+    matching_tasks.pop(key, None)
+    stats = user_stats.pop(key, None)
+    task_meta.pop(task_id, None)
+    if stats is not None:
+        try:
+            await record_run(task_id, chat_id, stats, stop_reason)
+        except Exception:
+            logger.exception("failed to record run %s", task_id)
+    lst = user_tokens.get(chat_id, [])
+    try:
+        if token in lst:
+            lst.remove(token)
+            if lst:
+                user_tokens[chat_id] = lst
+            else:
+                user_tokens.pop(chat_id, None)
+    except Exception:
+        pass
+    try:
+        await delete_task(task_id)
+    except Exception:
+        logger.exception("failed to delete task %s", task_id)
+    if ipc is not None:
+        ipc.send({"op": "finished", "task_id": task_id})
+
+def stop_keyboard(task_id):
+    # plain Bot API JSON: worker processes pass it on without importing
+    # aiogram, and the parent turns it into markup when it edits the message
+    return {"inline_keyboard": [[{"text": "Stop", "callback_data": f"stop_task:{task_id}"}]]}
+
+def launch_matching_task(chat_id, token, explore_url, stat_msg, task_id, stats=None):
+    key = f"{chat_id}:{token}"
+    lst = user_tokens.get(chat_id, [])
+    if token not in lst:
+        lst.append(token)
+        user_tokens[chat_id] = lst
+    keyboard = stop_keyboard(task_id)
+    if worker_pool is not None:
+        stats = stats or TaskStats()
+        user_stats[key] = stats
+        task = worker_pool.start_task(chat_id, token, explore_url, stat_msg.message_id, task_id, stats)
+    else:
+        task = asyncio.create_task(start_matching(chat_id, token, explore_url, stat_msg, task_id, keyboard, stats))
+    matching_tasks[key] = task
+    task_meta[task_id] = {"key": key, "stat_msg": stat_msg, "running": True, "token": token}
+    return task
+
+async def resume_tasks():
+    try:
+        rows = await list_saved_tasks()
+    except Exception:
+        logger.exception("failed to load saved tasks")
+        return
+    resumed = 0
+    for task_id, chat_id, token, explore_url, message_id, requests, cycles, errors in rows:
+        if resumed:
+            await asyncio.sleep(TASK_RESUME_STAGGER * random.uniform(0.5, 1.5))
+        if f"{chat_id}:{token}" in matching_tasks:
+            # the user restarted this token during the stagger; its new
+            # session saved its own row, and this one would come back later
+            await delete_task(task_id)
+            continue
+        stats = TaskStats(requests, cycles, errors)
+        launch_matching_task(chat_id, token, explore_url, StatMessage(chat_id, message_id), task_id, stats)
+        resumed += 1
+    if resumed:
+        logger.info("resumed %d matching tasks", resumed)
+
+async def stop_all_tasks():
+    global shutting_down
+    shutting_down = True
+    if worker_pool is not None:
+        await worker_pool.close()
+    tasks = [task for task in matching_tasks.values() if isinstance(task, asyncio.Task)]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await checkpoint_tasks()
+    except Exception:
+        logger.exception("final task checkpoint failed")
+
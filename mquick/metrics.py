@@ -0,0 +1,120 @@
+import functools
+import logging
+import time
+
+from .settings import METRICS_BUCKETS, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger("mquick")
+
+class Metrics:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.help = {}
+        self.types = {}
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def describe(self, name, kind, text):
+        self.types[name] = kind
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += value
+        hist[2] += 1
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        samples = {}
+        for (name, labels), value in self.counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), (counts, total, count) in self.histograms.items():
+            series = samples.setdefault(name, [])
+            for bound, n in zip(self.buckets, counts):
+                series.append((f"{name}_bucket", labels + (("le", str(bound)),), n))
+            series.append((f"{name}_bucket", labels + (("le", "+Inf"),), count))
+            series.append((f"{name}_sum", labels, total))
+            series.append((f"{name}_count", labels, count))
+        for fn in self.collectors:
+            for name, labels, value in fn():
+                samples.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(samples):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types[name]}")
+            for sample, labels, value in samples[name]:
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                    lines.append(f"{sample}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metrics = Metrics()
+metrics.describe("mquick_task_requests_total", "counter", "Answer requests sent by a running matching task.")
+metrics.describe("mquick_task_cycles_total", "counter", "Explore cycles completed by a running matching task.")
+metrics.describe("mquick_task_errors_total", "counter", "Answer errors seen by a running matching task.")
+metrics.describe("mquick_task_stops_total", "counter", "Matching tasks that ended, by stop reason.")
+metrics.describe("mquick_http_request_seconds", "histogram", "Meeff API call latency by endpoint and status.")
+metrics.describe("mquick_db_query_seconds", "histogram", "SQLite helper latency by helper function.")
+metrics.describe("mquick_matching_tasks", "gauge", "Entries in matching_tasks.")
+metrics.describe("mquick_task_meta", "gauge", "Entries in task_meta.")
+metrics.describe("mquick_history_writer_queue", "gauge", "History operations waiting for the writer.")
+metrics.describe("mquick_history_writer_flushes_total", "counter", "History writer transactions committed.")
+metrics.describe("mquick_history_writer_ops_total", "counter", "History operations committed by the writer.")
+metrics.describe("mquick_history_cache_lookups_total", "counter", "History dedupe cache lookups by result.")
+metrics.describe("mquick_stats_edits_total", "counter", "Live-stats message edits by outcome.")
+metrics.describe("mquick_update_seconds", "histogram", "Telegram update handling latency by intake mode.")
+metrics.describe("mquick_webhook_queue_wait_seconds", "histogram", "Time webhook updates spent queued before handling.")
+metrics.describe("mquick_webhook_rejected_total", "counter", "Webhook requests rejected, by reason.")
+metrics.describe("mquick_webhook_queue", "gauge", "Webhook updates waiting for a worker.")
+metrics.describe("mquick_scheduler_running", "gauge", "Slots in use, by scheduler.")
+metrics.describe("mquick_scheduler_queued", "gauge", "Waiters queued for a slot, by scheduler.")
+metrics.describe("mquick_scheduler_queued_total", "counter", "Acquisitions that had to queue, by scheduler.")
+metrics.describe("mquick_scheduler_granted_total", "counter", "Slots handed out, by scheduler.")
+metrics.describe("mquick_scheduler_wait_seconds", "histogram", "Time spent queued for a slot, by scheduler.")
+metrics.describe("mquick_loop_lag_seconds", "histogram", "How late the event loop ran a timer scheduled by the lag sampler.")
+metrics.describe("mquick_loop_stalls_total", "counter", "Event loop stalls longer than LOOP_LAG_THRESHOLD.")
+
+def db_timed(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            metrics.observe("mquick_db_query_seconds", time.perf_counter() - start, helper=fn.__name__)
+    return wrapper
+
+async def _metrics_handler(request):
+    from aiohttp import web
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return runner
+
@@ -0,0 +1,289 @@
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import unquote, urlparse
+
+from .settings import STORAGE_CONNECTIONS, STORAGE_PREFIX
+
+class RespError(Exception):
+    pass
+
+def _encode(args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+async def _read_reply(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("storage server closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"bad reply from storage server: {line!r}")
+
+class RespClient:
+    # minimal Redis-protocol client: a small connection pool where every
+    # call writes its commands in one go and reads the replies back in order
+    def __init__(self, url, size=STORAGE_CONNECTIONS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.size = size
+        self.queue = None
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        conn = (reader, writer)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._call(conn, setup)
+        return conn
+
+    async def open(self):
+        self.queue = asyncio.Queue()
+        for _ in range(self.size):
+            self.queue.put_nowait(await self._connect())
+
+    async def close(self):
+        queue, self.queue = self.queue, None
+        while queue is not None and not queue.empty():
+            conn = queue.get_nowait()
+            if conn is not None:
+                conn[1].close()
+
+    @asynccontextmanager
+    async def _acquire(self):
+        conn = await self.queue.get()
+        try:
+            if conn is None:
+                conn = await self._connect()
+            yield conn
+        except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # a reply may still be in flight; reconnect on the next use
+            # rather than read it as the answer to someone else's command
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            raise
+        finally:
+            self.queue.put_nowait(conn)
+
+    async def _call(self, conn, commands):
+        reader, writer = conn
+        writer.write(b"".join(_encode(command) for command in commands))
+        await writer.drain()
+        replies = [await _read_reply(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def pipeline(self, commands):
+        if not commands:
+            return []
+        async with self._acquire() as conn:
+            return await self._call(conn, commands)
+
+    async def execute(self, *args):
+        return (await self.pipeline([args]))[0]
+
+class RedisStorage:
+    # shared history, config and country filters for running several bot
+    # instances; SADD on the users set is the dedupe gate, reservations sit
+    # in a hash of user_id -> "chat_id|reserved_at" until marked or dropped
+    name = "redis"
+    shared = True
+
+    def __init__(self, url, prefix=STORAGE_PREFIX):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.epoch = None
+
+    def key(self, *parts):
+        return self.prefix + ":".join(str(p) for p in parts)
+
+    async def open(self):
+        await self.client.open()
+        await self.history_changed()
+
+    async def close(self):
+        await self.client.close()
+
+    async def flush(self):
+        pass
+
+    async def _transaction(self, commands):
+        # MULTI/EXEC: the commands apply together or not at all
+        return (await self.client.pipeline([("MULTI",), *commands, ("EXEC",)]))[-1]
+
+    async def reserve(self, user_id, chat_id, now):
+        # one transaction, so a reservation never exists without its user and
+        # chat entries; HSETNX keeps a losing reserve from replacing the
+        # winner's reservation, and the loser takes back what it added
+        added, reserved, in_chat, _ = await self._transaction([
+            ("SADD", self.key("users"), user_id),
+            ("HSETNX", self.key("reserved"), user_id, f"{chat_id}|{now}"),
+            ("SADD", self.key("chat", chat_id), user_id),
+            ("SADD", self.key("chats"), chat_id),
+        ])
+        if added:
+            return True
+        undo = []
+        if reserved:
+            undo.append(("HDEL", self.key("reserved"), user_id))
+        if in_chat:
+            undo.append(("SREM", self.key("chat", chat_id), user_id))
+        if undo:
+            await self._transaction(undo)
+        return False
+
+    async def mark(self, user_id, chat_id, now):
+        await self.client.pipeline([
+            ("SADD", self.key("users"), user_id),
+            ("HDEL", self.key("reserved"), user_id),
+            ("SADD", self.key("chat", chat_id), user_id),
+            ("SADD", self.key("chats"), chat_id),
+        ])
+
+    async def import_rows(self, rows):
+        # rows of (user_id, chat_id, added_at) arrive as marked users; there
+        # is no per-user added_at to keep. Returns the new chat memberships
+        if not rows:
+            return 0
+        by_chat = {}
+        for user_id, chat_id, _ in rows:
+            by_chat.setdefault(chat_id, []).append(user_id)
+        user_ids = [row[0] for row in rows]
+        replies = await self._transaction(
+            [("SADD", self.key("users"), *user_ids), ("HDEL", self.key("reserved"), *user_ids)]
+            + [("SADD", self.key("chat", chat_id), *ids) for chat_id, ids in by_chat.items()]
+            + [("SADD", self.key("chats"), *by_chat)]
+        )
+        return sum(replies[2:-1])
+
+    async def _drop_reserved(self, user_id, chat_id):
+        # HDEL decides the race with a concurrent mark: whoever removes the
+        # reservation owns the user
+        if not await self.client.execute("HDEL", self.key("reserved"), user_id):
+            return False
+        await self.client.pipeline([
+            ("SREM", self.key("users"), user_id),
+            ("SREM", self.key("chat", chat_id), user_id),
+        ])
+        return True
+
+    async def unreserve(self, user_id):
+        value = await self.client.execute("HGET", self.key("reserved"), user_id)
+        if value is not None:
+            await self._drop_reserved(user_id, value.split("|", 1)[0])
+
+    async def expire(self, cutoff, limit, reserved_only=False):
+        # only stale reservations expire here; there is no per-user added_at
+        # to apply HISTORY_RETENTION_DAYS to
+        if not reserved_only:
+            return []
+        flat = await self.client.execute("HGETALL", self.key("reserved"))
+        expired = []
+        for user_id, value in zip(flat[::2], flat[1::2]):
+            chat_id, _, reserved_at = value.partition("|")
+            if reserved_at < cutoff and await self._drop_reserved(user_id, chat_id):
+                expired.append(user_id)
+                if len(expired) >= limit:
+                    break
+        if expired:
+            self._bumped(await self.client.execute("INCR", self.key("history_epoch")))
+        return expired
+
+    def _bumped(self, epoch):
+        # this replica's own bump needs no reload, unless another replica
+        # bumped in between
+        if self.epoch is not None and epoch == self.epoch + 1:
+            self.epoch = epoch
+
+    async def history_changed(self):
+        # clears and expiries bump a shared counter, so a replica whose
+        # dedupe cache still holds the removed users knows to reload it
+        epoch = int(await self.client.execute("GET", self.key("history_epoch")) or 0)
+        changed = self.epoch is not None and epoch != self.epoch
+        self.epoch = epoch
+        return changed
+
+    async def history_count(self, chat_id=0):
+        if chat_id == 0:
+            return await self.client.execute("SCARD", self.key("users"))
+        return await self.client.execute("SCARD", self.key("chat", chat_id))
+
+    async def iter_user_ids(self, chunk):
+        cursor = "0"
+        while True:
+            cursor, user_ids = await self.client.execute("SSCAN", self.key("users"), cursor, "COUNT", chunk)
+            if user_ids:
+                yield user_ids
+            if cursor == "0":
+                return
+
+    async def clear_history(self, chat_id=None):
+        chats = await self.client.execute("SMEMBERS", self.key("chats"))
+        if chat_id is None:
+            replies = await self._transaction(
+                [("DEL", self.key("users"), self.key("reserved"), self.key("chats"))]
+                + [("DEL", self.key("chat", c)) for c in chats]
+                + [("INCR", self.key("history_epoch"))]
+            )
+            self._bumped(replies[-1])
+            return None
+        # users seen by another chat stay in the shared dedupe set
+        others = [c for c in chats if c != str(chat_id)]
+        members = set(await self.client.execute("SMEMBERS", self.key("chat", chat_id)))
+        shared = await self.client.pipeline(
+            [("SINTER", self.key("chat", chat_id), self.key("chat", c)) for c in others]
+        )
+        drop = list(members.difference(*shared))
+        commands = [("DEL", self.key("chat", chat_id)), ("SREM", self.key("chats"), chat_id)]
+        for i in range(0, len(drop), 1000):
+            batch = drop[i:i + 1000]
+            commands.append(("SREM", self.key("users"), *batch))
+            commands.append(("HDEL", self.key("reserved"), *batch))
+        commands.append(("INCR", self.key("history_epoch")))
+        self._bumped((await self._transaction(commands))[-1])
+        return drop
+
+    async def get_config(self, key):
+        return await self.client.execute("HGET", self.key("config"), key)
+
+    async def set_config(self, key, value):
+        await self.client.execute("HSET", self.key("config"), key, value)
+
+    async def list_excluded(self, chat_id):
+        return sorted(await self.client.execute("SMEMBERS", self.key("exclude", chat_id)))
+
+    async def add_excluded(self, chat_id, countries):
+        if countries:
+            await self.client.execute("SADD", self.key("exclude", chat_id), *countries)
+
+    async def clear_excluded(self, chat_id):
+        await self.client.execute("DEL", self.key("exclude", chat_id))
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from .metrics import metrics
+from .settings import LOOP_BACKEND, LOOP_LAG_INTERVAL, LOOP_LAG_STACK_DEPTH, LOOP_LAG_THRESHOLD
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger("mquick")
+
+def run(coro, backend=LOOP_BACKEND):
+    # LOOP_BACKEND: asyncio (default), uvloop (required) or auto (uvloop if installed)
+    if backend == "uvloop" and uvloop is None:
+        coro.close()
+        raise RuntimeError("LOOP_BACKEND=uvloop but uvloop is not installed")
+    if backend in ("uvloop", "auto") and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
+
+def _task_frames(frame):
+    # drop the event loop's own frames above the callback that is running
+    frames = traceback.extract_stack(frame)
+    for i, entry in enumerate(frames):
+        if entry.name == "_run" and entry.filename == asyncio.events.__file__:
+            frames = frames[i + 1:]
+            break
+    return frames[-LOOP_LAG_STACK_DEPTH:]
+
+class LoopLagMonitor:
+    # the sampler measures how late its own sleeps wake up; a watchdog
+    # thread sees a stall while it is still going on and logs the stack the
+    # loop thread is stuck in, which is gone by the time the sampler wakes
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD, keep=1000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=keep)
+        self.samples = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.beat = None
+        self.reported = None
+        self.loop = None
+        self.loop_thread = None
+
+    def record(self, lag, logged=False):
+        lag = max(lag, 0.0)
+        self.lags.append(lag)
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        metrics.observe("mquick_loop_lag_seconds", lag)
+        if lag >= self.threshold:
+            self.stalls += 1
+            metrics.inc("mquick_loop_stalls_total")
+            if not logged:
+                logger.warning("event loop lagged %.3fs", lag)
+
+    def percentile(self, q):
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def summary(self):
+        return {
+            "loop": type(self.loop).__module__.split(".", 1)[0] if self.loop else None,
+            "samples": self.samples,
+            "stalls": self.stalls,
+            "lag_p50_ms": round(self.percentile(0.5) * 1000, 2),
+            "lag_p99_ms": round(self.percentile(0.99) * 1000, 2),
+            "lag_max_ms": round(self.max_lag * 1000, 2),
+        }
+
+    def _report(self, beat, stalled):
+        self.reported = beat
+        frame = sys._current_frames().get(self.loop_thread)
+        task = asyncio.current_task(self.loop)
+        where = task.get_name() if task is not None else "loop callback"
+        if task is not None:
+            where += f" ({getattr(task.get_coro(), '__qualname__', '?')})"
+        stack = "".join(traceback.format_list(_task_frames(frame))) if frame else "  unavailable\n"
+        logger.warning("event loop stalled for %.3fs so far in %s:\n%s", stalled, where, stack.rstrip())
+
+    def _watch(self, stopping):
+        while not stopping.wait(self.threshold / 2):
+            beat = self.beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled >= self.threshold and beat != self.reported:
+                self._report(beat, stalled)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        stopping = threading.Event()
+        threading.Thread(target=self._watch, args=(stopping,), name="loop-lag-watchdog", daemon=True).start()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = now - self.beat - self.interval
+                logged = self.reported == self.beat
+                self.beat = now
+                self.record(lag, logged)
+        finally:
+            stopping.set()
+
+loop_monitor = LoopLagMonitor()
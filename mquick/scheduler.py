@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .metrics import metrics
+from .settings import (
+    SCHEDULER_DB_SLOTS,
+    SCHEDULER_HTTP_SLOTS,
+    SCHEDULER_MAX_TASKS,
+    SCHEDULER_MAX_TASKS_PER_CHAT,
+)
+
+class Waiter:
+    __slots__ = ("chat_id", "future", "queued_at")
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+class FairScheduler:
+    # a semaphore with a global limit and an optional per-chat limit; when
+    # slots run out, waiters queue per chat and freed slots are shared out
+    # between the chats, so one chat with many waiters can't take them all
+    def __init__(self, name, limit, per_chat=0):
+        self.name = name
+        self.limit = limit
+        self.per_chat = per_chat
+        self.running = {}
+        self.total = 0
+        self.waiting = {}
+        self.order = deque()
+        self.queued = 0
+        self.granted = 0
+        self.recent_waits = deque(maxlen=100)
+
+    def _has_room(self, chat_id):
+        if self.limit > 0 and self.total >= self.limit:
+            return False
+        return self.per_chat <= 0 or self.running.get(chat_id, 0) < self.per_chat
+
+    def _take(self, chat_id):
+        self.running[chat_id] = self.running.get(chat_id, 0) + 1
+        self.total += 1
+        self.granted += 1
+
+    def try_acquire(self, chat_id):
+        if chat_id in self.waiting or not self._has_room(chat_id):
+            return False
+        self._take(chat_id)
+        return True
+
+    def release(self, chat_id):
+        count = self.running.get(chat_id, 0) - 1
+        if count > 0:
+            self.running[chat_id] = count
+        else:
+            self.running.pop(chat_id, None)
+        self.total -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        # the chat with the fewest slots in use goes first; ties go to the
+        # chat that has waited longest since its last grant
+        while self.order and (self.limit <= 0 or self.total < self.limit):
+            ready = [chat_id for chat_id in self.order if self._has_room(chat_id)]
+            if not ready:
+                return
+            chat_id = min(ready, key=lambda c: self.running.get(c, 0))
+            self.order.remove(chat_id)
+            queue = self.waiting[chat_id]
+            waiter = queue.popleft()
+            if queue:
+                self.order.append(chat_id)
+            else:
+                del self.waiting[chat_id]
+            self._take(chat_id)
+            waiter.future.set_result(None)
+
+    def _enqueue(self, chat_id):
+        waiter = Waiter(chat_id)
+        if chat_id not in self.waiting:
+            self.waiting[chat_id] = deque()
+            self.order.append(chat_id)
+        self.waiting[chat_id].append(waiter)
+        self.queued += 1
+        return waiter
+
+    def _drop(self, waiter):
+        queue = self.waiting.get(waiter.chat_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.waiting[waiter.chat_id]
+            self.order.remove(waiter.chat_id)
+
+    def position(self, waiter):
+        queue = self.waiting.get(waiter.chat_id, ())
+        return queue.index(waiter) + 1 if waiter in queue else 0
+
+    def depth(self, chat_id=None):
+        if chat_id is not None:
+            return len(self.waiting.get(chat_id, ()))
+        return sum(len(queue) for queue in self.waiting.values())
+
+    def average_wait(self):
+        return sum(self.recent_waits) / len(self.recent_waits) if self.recent_waits else 0.0
+
+    async def acquire(self, chat_id, on_wait=None, interval=None):
+        # returns the seconds spent queued; on_wait(waiter) is awaited every
+        # interval seconds while still queued
+        if self.try_acquire(chat_id):
+            return 0.0
+        waiter = self._enqueue(chat_id)
+        try:
+            while not waiter.future.done():
+                if on_wait is not None:
+                    await on_wait(waiter)
+                    if waiter.future.done():
+                        break
+                await asyncio.wait((waiter.future,), timeout=interval)
+        except BaseException:
+            if waiter.future.done():
+                self.release(chat_id)
+            else:
+                self._drop(waiter)
+            raise
+        waited = time.monotonic() - waiter.queued_at
+        self.recent_waits.append(waited)
+        metrics.observe("mquick_scheduler_wait_seconds", waited, scheduler=self.name)
+        return waited
+
+    @asynccontextmanager
+    async def slot(self, chat_id):
+        await self.acquire(chat_id)
+        try:
+            yield
+        finally:
+            self.release(chat_id)
+
+    def collect(self):
+        labels = {"scheduler": self.name}
+        yield "mquick_scheduler_running", labels, self.total
+        yield "mquick_scheduler_queued", labels, self.depth()
+        yield "mquick_scheduler_queued_total", labels, self.queued
+        yield "mquick_scheduler_granted_total", labels, self.granted
+
+task_scheduler = FairScheduler("tasks", SCHEDULER_MAX_TASKS, SCHEDULER_MAX_TASKS_PER_CHAT)
+http_scheduler = FairScheduler("http", SCHEDULER_HTTP_SLOTS)
+db_scheduler = FairScheduler("db", SCHEDULER_DB_SLOTS)
+schedulers = (task_scheduler, http_scheduler, db_scheduler)
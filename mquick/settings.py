@@ -0,0 +1,74 @@
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "mquick.db")
+SQLITE_READERS = int(os.environ.get("SQLITE_READERS", "3"))
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")
+STORAGE_URL = os.environ.get("STORAGE_URL", "redis://127.0.0.1:6379/0")
+STORAGE_PREFIX = os.environ.get("STORAGE_PREFIX", "mquick:")
+STORAGE_CONNECTIONS = int(os.environ.get("STORAGE_CONNECTIONS", "4"))
+STORAGE_SETTINGS_TTL = float(os.environ.get("STORAGE_SETTINGS_TTL", "30"))
+HISTORY_MIGRATION_CHUNK = int(os.environ.get("HISTORY_MIGRATION_CHUNK", "5000"))
+HISTORY_WRITE_BATCH = int(os.environ.get("HISTORY_WRITE_BATCH", "200"))
+HISTORY_WRITE_WINDOW = float(os.environ.get("HISTORY_WRITE_WINDOW_MS", "50")) / 1000
+HISTORY_CACHE_BYTES = int(float(os.environ.get("HISTORY_CACHE_MB", "64")) * 1024 * 1024)
+HISTORY_CACHE_ENTRY_BYTES = 120
+HISTORY_EXPORT_CHUNK = int(os.environ.get("HISTORY_EXPORT_CHUNK", "5000"))
+HISTORY_EXPORT_DIR = os.environ.get("HISTORY_EXPORT_DIR", "exports")
+STATS_MESSAGE_INTERVAL = float(os.environ.get("STATS_MESSAGE_INTERVAL", "3"))
+STATS_CHAT_INTERVAL = float(os.environ.get("STATS_CHAT_INTERVAL", "1"))
+STATS_EDIT_RATE = float(os.environ.get("STATS_EDIT_RATE", "25"))
+STATS_EDIT_BURST = float(os.environ.get("STATS_EDIT_BURST", "25"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", "0"))
+RESERVED_STALE_SECONDS = float(os.environ.get("RESERVED_STALE_SECONDS", "600"))
+MAINTENANCE_INTERVAL = float(os.environ.get("MAINTENANCE_INTERVAL", "300"))
+MAINTENANCE_CHUNK = int(os.environ.get("MAINTENANCE_CHUNK", "1000"))
+MAINTENANCE_PAUSE = float(os.environ.get("MAINTENANCE_PAUSE", "0.2"))
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get("MAINTENANCE_VACUUM_PAGES", "1000"))
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "8"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get("WEBHOOK_ENQUEUE_TIMEOUT", "1"))
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))
+WORKER_STATS_INTERVAL = float(os.environ.get("WORKER_STATS_INTERVAL", "1"))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_SINKS = [x.strip() for x in os.environ.get("TRACE_SINKS", "log").split(",") if x.strip()]
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_RECENT = int(os.environ.get("TRACE_RECENT", "500"))
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").replace(",", " ").split()}
+STATS_RATE_WINDOW = float(os.environ.get("STATS_RATE_WINDOW", "300"))
+TASK_CHECKPOINT_INTERVAL = float(os.environ.get("TASK_CHECKPOINT_INTERVAL", "30"))
+TASK_RESUME_STAGGER = float(os.environ.get("TASK_RESUME_STAGGER", "2"))
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SCHEDULER_MAX_TASKS = int(os.environ.get("SCHEDULER_MAX_TASKS", "200"))
+SCHEDULER_MAX_TASKS_PER_CHAT = int(os.environ.get("SCHEDULER_MAX_TASKS_PER_CHAT", "5"))
+SCHEDULER_HTTP_SLOTS = int(os.environ.get("SCHEDULER_HTTP_SLOTS", str(HTTP_MAX_CONNECTIONS)))
+SCHEDULER_DB_SLOTS = int(os.environ.get("SCHEDULER_DB_SLOTS", "64"))
+SCHEDULER_QUEUE_REFRESH = float(os.environ.get("SCHEDULER_QUEUE_REFRESH", "10"))
+LOOP_BACKEND = os.environ.get("LOOP_BACKEND", "asyncio")
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD", "0.25"))
+LOOP_LAG_STACK_DEPTH = int(os.environ.get("LOOP_LAG_STACK_DEPTH", "20"))
+IDLE_BACKOFF = os.environ.get("IDLE_BACKOFF", "jittered")
+IDLE_BACKOFF_BASE = float(os.environ.get("IDLE_BACKOFF_BASE", "1"))
+IDLE_BACKOFF_FACTOR = float(os.environ.get("IDLE_BACKOFF_FACTOR", "2"))
+IDLE_BACKOFF_MAX = float(os.environ.get("IDLE_BACKOFF_MAX", "120"))
+IDLE_STOP_AFTER = float(os.environ.get("IDLE_STOP_AFTER", "3600"))
+IDLE_PARK_AFTER = float(os.environ.get("IDLE_PARK_AFTER", "10"))
@@ -0,0 +1,123 @@
+import asyncio
+import hmac
+import logging
+import signal
+import time
+
+from aiogram.types import Update
+from aiohttp import web
+
+from .matching import json_loads
+from .metrics import metrics
+from .settings import (
+    WEBHOOK_ENQUEUE_TIMEOUT,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+
+logger = logging.getLogger("mquick")
+
+class WebhookServer:
+    def __init__(
+        self,
+        bot,
+        dp,
+        path=WEBHOOK_PATH,
+        secret=WEBHOOK_SECRET,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS,
+        enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+    ):
+        if not secret:
+            # without it anyone who reaches the port can post forged updates
+            raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret = secret.encode()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.worker_tasks = []
+        self.runner = None
+
+    async def handle(self, request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            metrics.inc("mquick_webhook_rejected_total", reason="secret")
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(loads=json_loads), context={"bot": self.bot})
+        except Exception:
+            metrics.inc("mquick_webhook_rejected_total", reason="invalid")
+            return web.Response(status=400)
+        try:
+            await asyncio.wait_for(self.queue.put((time.perf_counter(), update)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # a non-2xx reply makes Telegram redeliver the update later
+            metrics.inc("mquick_webhook_rejected_total", reason="queue_full")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            queued_at, update = await self.queue.get()
+            metrics.observe("mquick_webhook_queue_wait_seconds", time.perf_counter() - queued_at)
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("failed to handle update %s", update.update_id)
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info("webhook listening on http://%s:%s%s", host, port, self.path)
+
+    async def stop(self, drain_timeout=10):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("dropping %d queued updates on shutdown", self.queue.qsize())
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+webhook_server = None
+
+@metrics.collector
+def collect_webhook_metrics():
+    if webhook_server is not None:
+        yield "mquick_webhook_queue", {}, webhook_server.queue.qsize()
+
+async def run_webhook(bot, dp):
+    global webhook_server
+    webhook_server = WebhookServer(bot, dp)
+    await webhook_server.start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=dp.resolve_used_update_types())
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await webhook_server.stop()
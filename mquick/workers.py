@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from . import matching
+from .db import close_db, history_cache, history_writer, init_db, invalidate_chat_settings
+from .matching import (
+    StatMessage,
+    TaskStats,
+    http_sessions,
+    launch_matching_task,
+    matching_tasks,
+    stop_all_tasks,
+    task_meta,
+    tracer,
+    user_stats,
+    user_tokens,
+)
+from .runtime import loop_monitor
+from .settings import LOOP_LAG_INTERVAL, WORKER_PROCESSES, WORKER_STATS_INTERVAL
+
+logger = logging.getLogger("mquick")
+
+# workers run as "python -m mquick --worker N" with the package's parent on the path
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+
+class RemoteTask:
+    def __init__(self, worker, task_id):
+        self.worker = worker
+        self.task_id = task_id
+        self.finished = False
+
+    def cancel(self):
+        if not self.finished:
+            self.worker.send({"op": "stop", "task_id": self.task_id})
+        return True
+
+    def done(self):
+        return self.finished
+
+class WorkerProcess:
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.proc = None
+        self.reader_task = None
+        self.tasks = {}
+        self.renders = {}
+        self.render_tasks = {}
+
+    async def spawn(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", __package__, "--worker", str(self.index),
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (PROJECT_ROOT, os.environ.get("PYTHONPATH"))))},
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=2 ** 20,
+        )
+        self.reader_task = asyncio.create_task(self._read())
+        for task_id, (chat_id, token, explore_url, message_id) in self.tasks.items():
+            stats = user_stats.get(f"{chat_id}:{token}")
+            self._send_start(task_id, chat_id, token, explore_url, message_id, stats)
+
+    def send(self, message):
+        if self.proc is None or self.proc.stdin.is_closing():
+            return
+        self.proc.stdin.write(json.dumps(message).encode() + b"\n")
+
+    def _send_start(self, task_id, chat_id, token, explore_url, message_id, stats):
+        self.send({
+            "op": "start", "task_id": task_id, "chat_id": chat_id, "token": token,
+            "explore_url": explore_url, "message_id": message_id, "stats": stats.as_dict() if stats else None,
+        })
+
+    def start_task(self, chat_id, token, explore_url, message_id, task_id, stats):
+        self.tasks[task_id] = (chat_id, token, explore_url, message_id)
+        self._send_start(task_id, chat_id, token, explore_url, message_id, stats)
+        return RemoteTask(self, task_id)
+
+    async def _read(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            try:
+                await self._handle(json.loads(line))
+            except Exception:
+                logger.exception("worker %d: bad message", self.index)
+        code = await self.proc.wait()
+        if not self.pool.closing:
+            logger.error("worker %d exited with %s, restarting", self.index, code)
+            await asyncio.sleep(1)
+            await self.spawn()
+
+    async def _handle(self, message):
+        op = message.get("op")
+        if op == "stats":
+            for task_id, stats in message["stats"].items():
+                meta = task_meta.get(task_id)
+                if meta and meta["key"] in user_stats:
+                    user_stats[meta["key"]].update(stats)
+        elif op == "render":
+            self._queue_render(message)
+        elif op == "forget":
+            matching.stats_renderer.forget(StatMessage(message["chat_id"], message["message_id"]))
+        elif op == "trace":
+            tracer.record(message["trace"])
+        elif op == "finished":
+            task_id = message["task_id"]
+            entry = self.tasks.pop(task_id, None)
+            meta = task_meta.get(task_id)
+            if meta:
+                task = matching_tasks.get(meta["key"])
+                if isinstance(task, RemoteTask):
+                    task.finished = True
+            if entry:
+                chat_id, token = entry[0], entry[1]
+                key = f"{chat_id}:{token}"
+                matching_tasks.pop(key, None)
+                user_stats.pop(key, None)
+                task_meta.pop(task_id, None)
+                lst = user_tokens.get(chat_id, [])
+                if token in lst:
+                    lst.remove(token)
+                    if not lst:
+                        user_tokens.pop(chat_id, None)
+
+    def _queue_render(self, message):
+        # Telegram edits run off the reader loop, one at a time per stats
+        # message; a newer render replaces one still waiting for its turn
+        key = (message["chat_id"], message["message_id"])
+        pending = self.renders.get(key)
+        if pending is not None and pending.get("force"):
+            message["force"] = True
+        self.renders[key] = message
+        if key not in self.render_tasks:
+            self.render_tasks[key] = asyncio.create_task(self._render(key))
+
+    async def _render(self, key):
+        try:
+            while key in self.renders:
+                message = self.renders.pop(key)
+                try:
+                    await matching.stats_renderer.render(
+                        StatMessage(message["chat_id"], message["message_id"]),
+                        message["text"],
+                        reply_markup=message.get("reply_markup"),
+                        force=message.get("force", False),
+                    )
+                except Exception:
+                    logger.exception("worker %d: render failed", self.index)
+        finally:
+            self.render_tasks.pop(key, None)
+
+    async def close(self, timeout=30):
+        if self.proc is None:
+            return
+        self.send({"op": "shutdown"})
+        try:
+            await asyncio.wait_for(self.reader_task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("worker %d did not stop in time, killing it", self.index)
+            self.proc.kill()
+            await self.proc.wait()
+        await asyncio.gather(*self.render_tasks.values(), return_exceptions=True)
+
+class WorkerPool:
+    def __init__(self, size=WORKER_PROCESSES):
+        self.workers = [WorkerProcess(self, i) for i in range(size)]
+        self.closing = False
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.spawn()
+        logger.info("started %d matching worker processes", len(self.workers))
+
+    def worker_for(self, chat_id):
+        return self.workers[chat_id % len(self.workers)]
+
+    def start_task(self, chat_id, token, explore_url, message_id, task_id, stats):
+        return self.worker_for(chat_id).start_task(chat_id, token, explore_url, message_id, task_id, stats)
+
+    def send_to_chat(self, chat_id, message):
+        self.worker_for(chat_id).send(message)
+
+    def broadcast(self, message):
+        for worker in self.workers:
+            worker.send(message)
+
+    async def close(self):
+        self.closing = True
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+
+class IpcChannel:
+    # stdout as an asyncio pipe transport: a parent that is slow to read
+    # makes writes buffer instead of blocking the worker's event loop
+    def __init__(self):
+        self.writer = None
+
+    async def open(self, pipe=None):
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(
+            lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), pipe or sys.stdout
+        )
+        self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b"\n")
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+class IpcStatsRenderer:
+    def __init__(self, channel):
+        self.channel = channel
+        self.last_text = {}
+
+    async def render(self, msg, text, reply_markup=None, force=False):
+        key = (msg.chat.id, msg.message_id)
+        if self.last_text.get(key) == (text, reply_markup):
+            return False
+        self.last_text[key] = (text, reply_markup)
+        self.channel.send({
+            "op": "render",
+            "chat_id": msg.chat.id,
+            "message_id": msg.message_id,
+            "text": text,
+            "reply_markup": reply_markup,
+            "force": force,
+        })
+        return True
+
+    def forget(self, msg):
+        self.last_text.pop((msg.chat.id, msg.message_id), None)
+        self.channel.send({"op": "forget", "chat_id": msg.chat.id, "message_id": msg.message_id})
+        return 0
+
+async def worker_stats_loop():
+    while True:
+        await asyncio.sleep(WORKER_STATS_INTERVAL)
+        stats = {}
+        for task_id, meta in list(task_meta.items()):
+            if meta["key"] in user_stats:
+                stats[task_id] = user_stats[meta["key"]].as_dict()
+        if stats:
+            matching.ipc.send({"op": "stats", "stats": stats})
+
+async def worker_main():
+    logging.basicConfig(level=logging.INFO, format=f"worker {sys.argv[-1]}: %(levelname)s:%(name)s:%(message)s")
+    matching.ipc = IpcChannel()
+    await matching.ipc.open()
+    matching.stats_renderer = IpcStatsRenderer(matching.ipc)
+    await init_db()
+    await history_cache.load()
+    history_writer.start()
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    stats_task = asyncio.create_task(worker_stats_loop())
+    lag_task = asyncio.create_task(loop_monitor.run()) if LOOP_LAG_INTERVAL > 0 else None
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "shutdown":
+                break
+            if op == "start":
+                chat_id, token = message["chat_id"], message["token"]
+                if f"{chat_id}:{token}" in matching_tasks:
+                    continue
+                launch_matching_task(
+                    chat_id, token, message["explore_url"],
+                    StatMessage(chat_id, message["message_id"]), message["task_id"], TaskStats.from_dict(message.get("stats")),
+                )
+            elif op == "stop":
+                meta = task_meta.get(message["task_id"])
+                if meta:
+                    meta["running"] = False
+                    task = matching_tasks.pop(meta["key"], None)
+                    if task:
+                        task.cancel()
+            elif op == "settings":
+                invalidate_chat_settings(message["chat_id"])
+            elif op == "forget_users":
+                for user_id in message["user_ids"]:
+                    history_cache.discard(user_id)
+            elif op == "drop_users":
+                # a Bloom-mode cache reloads once, after the last chunk
+                if history_cache.bloom is None or message["last"]:
+                    await history_cache.drop(message["user_ids"])
+            elif op == "reload_cache":
+                await history_writer.flush()
+                await history_cache.load()
+    finally:
+        stats_task.cancel()
+        if lag_task:
+            lag_task.cancel()
+        await stop_all_tasks()
+        await http_sessions.close()
+        await history_writer.close()
+        await close_db()
+        await matching.ipc.close()
+